@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+GitHub Bots - A single service that runs both the Issue Bot and the PR Bot.
+
+Webhook deliveries for all events go to one /webhook endpoint and are dispatched
+on the X-GitHub-Event header, so a repository only needs one webhook and the two
+bots share one process, one GitHub connection pool and one worker pool.
+"""
+
+import logging
+import os
+
+import issue_bot
+import pr_bot
+from bot_common import start_auth_check, create_app
+
+logger = logging.getLogger(__name__)
+
+# Initialize Flask app with the event handlers of both bots
+app = create_app("Local GitHub Bots are running!", {
+    **issue_bot.EVENT_HANDLERS,
+    **pr_bot.EVENT_HANDLERS
+})
+
+if __name__ == '__main__':
+    # Verify GitHub authentication in the background if enabled
+    start_auth_check()
+
+    # Start the Flask server
+    port = int(os.getenv("PORT", "5000"))
+    logger.info("Starting GitHub Bots Flask server on http://localhost:%d", port)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
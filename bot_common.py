@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Shared plumbing for the GitHub bots.
+
+This module holds the configuration, the GitHub API session, webhook signature
+verification, the background worker pool and the Flask app factory used by the
+Issue Bot, the PR Bot and the combined service in app.py.
+"""
+
+import atexit
+import os
+import hmac
+import logging
+import queue
+import re
+import threading
+import time
+import orjson
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Blueprint, Response, g, request
+
+from env_loader import load_env_once
+
+# Load environment variables
+load_env_once()
+
+# Log to stderr; set LOG_LEVEL=DEBUG to see every step of each webhook delivery.
+# Request threads only put records on a queue; a listener thread formats and
+# writes them, so handlers never wait on stderr.
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_queue_handler = QueueHandler(queue.SimpleQueue())
+_log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[_log_queue_handler]
+)
+_LOG_LISTENER = QueueListener(_log_queue_handler.queue, _log_stream_handler)
+_LOG_LISTENER.start()
+atexit.register(_LOG_LISTENER.stop)
+
+def _restart_log_listener():
+    """Give a forked child (e.g. a Gunicorn worker) its own log queue and listener.
+
+    The child does not inherit the listener thread, and the inherited queue may
+    have been in use by it at the moment of the fork.
+    """
+    _log_queue_handler.queue = _LOG_LISTENER.queue = queue.SimpleQueue()
+    _LOG_LISTENER.start()
+
+os.register_at_fork(after_in_child=_restart_log_listener)
+logger = logging.getLogger(__name__)
+
+# Configuration
+GITHUB_PAT = os.getenv("GITHUB_PAT")
+if not GITHUB_PAT:
+    raise ValueError("GITHUB_PAT environment variable not set. Check your .env file.")
+
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+if not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET environment variable not set. Check your .env file.")
+
+# Set BOT_CHECK_AUTH=1 to verify the GitHub PAT when the server starts
+CHECK_AUTH_ON_STARTUP = os.getenv("BOT_CHECK_AUTH") == "1"
+
+# Shared HTTP session so every GitHub API call reuses one keep-alive connection pool
+SESSION = requests.Session()
+# Transient failures are retried with exponential backoff (1, 2, 4, ... seconds),
+# honouring Retry-After. POST is included so a rate-limited or briefly
+# unavailable API does not drop a comment. Once retries run out the last
+# response is returned rather than raised, for the callers' status checks.
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=6,
+        backoff_factor=1.0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+))
+SESSION.headers.update({
+    "Authorization": f"token {GITHUB_PAT}",
+    "Accept": "application/vnd.github.v3+json",
+    "User-Agent": "github-bot-rabbithole"
+})
+
+# (connect, read) timeout in seconds for every GitHub request, so a stalled
+# connection cannot tie up a worker thread indefinitely
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Conditional GET cache for GitHub API URLs: URL -> last 200 response,
+# revalidated with its ETag
+_ETAG_CACHE = OrderedDict()
+_ETAG_CACHE_LOCK = threading.Lock()
+_ETAG_CACHE_MAX_ENTRIES = 256
+
+# Recently seen X-GitHub-Delivery IDs, so retried deliveries are not processed twice
+_SEEN_DELIVERIES = OrderedDict()
+_SEEN_DELIVERIES_LOCK = threading.Lock()
+_SEEN_DELIVERIES_MAX_ENTRIES = 10000
+
+# Headers for request bodies serialized with orjson.dumps()
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Base URL of the GitHub REST API
+GITHUB_API_URL = "https://api.github.com"
+
+# Once fewer API requests than this remain, calls wait for the rate limit window to reset
+RATE_LIMIT_RESERVE = 100
+_rate_limit_reset_at = 0.0
+_RATE_LIMIT_LOCK = threading.Lock()
+
+# Background worker pool: webhooks are acknowledged immediately and the
+# GitHub API calls and AI review run here instead of in the request handler
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# With REDIS_URL set, background jobs go to a persistent RQ queue instead, so
+# work acknowledged to GitHub survives a restart; run `rq worker gh-webhooks`
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    from redis import Redis
+    from rq import Queue
+    JOB_QUEUE = Queue("gh-webhooks", connection=Redis.from_url(REDIS_URL))
+else:
+    JOB_QUEUE = None
+
+# Longest a queued RQ job may run, in seconds
+JOB_TIMEOUT = 600
+
+# IDs of executor jobs that are queued or running
+_JOBS_IN_FLIGHT = set()
+_JOBS_IN_FLIGHT_LOCK = threading.Lock()
+
+class TokenBucket:
+    """A thread-safe token bucket used to throttle calls to the GitHub API."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# GitHub's secondary rate limit allows about 80 content-creating requests per minute
+COMMENT_RATE_LIMITER = TokenBucket(rate=80 / 60, capacity=10)
+
+# Webhook secret encoded once, rather than on every delivery
+_SECRET_BYTES = WEBHOOK_SECRET.encode('utf-8')
+
+# X-Hub-Signature-256 values are "sha256=" followed by the 64-character hex digest
+_SIGNATURE_PREFIX = "sha256="
+_SIGNATURE_LENGTH = len(_SIGNATURE_PREFIX) + 64
+
+def _parse_signature(signature_header):
+    """Decode an X-Hub-Signature-256 header into the raw digest it carries.
+
+    This only looks at the header, so malformed signatures can be rejected
+    before any of the payload is hashed.
+
+    Returns:
+        bytes: The 32-byte digest, or None if the header is missing or malformed
+    """
+    if (not signature_header
+            or len(signature_header) != _SIGNATURE_LENGTH
+            or not signature_header.startswith(_SIGNATURE_PREFIX)):
+        return None
+
+    try:
+        return bytes.fromhex(signature_header[len(_SIGNATURE_PREFIX):])
+    except ValueError:
+        return None
+
+def _read_signed_body():
+    """Read the request body in chunks, hashing each chunk as it arrives.
+
+    Returns:
+        tuple: The body as a bytearray and its HMAC-SHA256 digest
+    """
+    mac = hmac.new(_SECRET_BYTES, digestmod='sha256')
+    body = bytearray()
+    while True:
+        chunk = request.stream.read(65536)
+        if not chunk:
+            break
+        mac.update(chunk)
+        body.extend(chunk)
+    return body, mac.digest()
+
+def _track_rate_limit(response):
+    """Record when to resume if a GitHub response shows the rate limit nearly used up."""
+    global _rate_limit_reset_at
+
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining is None or reset is None or int(remaining) >= RATE_LIMIT_RESERVE:
+        return
+
+    logger.warning("Only %s GitHub API requests left until %s", remaining, time.ctime(int(reset)))
+    with _RATE_LIMIT_LOCK:
+        _rate_limit_reset_at = max(_rate_limit_reset_at, float(reset))
+
+def _wait_for_rate_limit():
+    """Sleep until the rate limit window resets if too few requests remain."""
+    delay = _rate_limit_reset_at - time.time()
+    if delay > 0:
+        logger.warning("Waiting %.0f s for the GitHub rate limit to reset", delay)
+        time.sleep(delay)
+
+def github_post(path, data):
+    """POST a JSON body to the GitHub REST API.
+
+    Every call that creates content goes through here, so all of them share the
+    comment rate limiter, the request timeout and the rate limit tracking.
+
+    Args:
+        path (str): API path, e.g. "/repos/owner/repo/issues/1/comments"
+        data (dict): The request body
+
+    Returns:
+        requests.Response: The response from GitHub
+    """
+    COMMENT_RATE_LIMITER.acquire()
+    _wait_for_rate_limit()
+    response = SESSION.post(GITHUB_API_URL + path, data=orjson.dumps(data), headers=JSON_HEADERS, timeout=REQUEST_TIMEOUT)
+    _track_rate_limit(response)
+    return response
+
+def conditional_get(url):
+    """GET a URL through the shared session, revalidating earlier responses with their ETag.
+
+    GitHub answers a matching If-None-Match with 304 Not Modified, which has no
+    body and does not count against the rate limit; the cached 200 response is
+    returned in that case.
+
+    Args:
+        url (str): The URL to fetch
+
+    Returns:
+        requests.Response: The fresh response, or the cached one if unchanged
+    """
+    with _ETAG_CACHE_LOCK:
+        cached = _ETAG_CACHE.get(url)
+
+    headers = {"If-None-Match": cached.headers["ETag"]} if cached is not None else None
+    _wait_for_rate_limit()
+    response = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    _track_rate_limit(response)
+
+    if response.status_code == 304 and cached is not None:
+        with _ETAG_CACHE_LOCK:
+            if url in _ETAG_CACHE:
+                _ETAG_CACHE.move_to_end(url)
+        return cached
+
+    if response.status_code == 200 and "ETag" in response.headers:
+        with _ETAG_CACHE_LOCK:
+            _ETAG_CACHE[url] = response
+            _ETAG_CACHE.move_to_end(url)
+            while len(_ETAG_CACHE) > _ETAG_CACHE_MAX_ENTRIES:
+                _ETAG_CACHE.popitem(last=False)
+
+    return response
+
+# Bodies of the fixed webhook responses, serialized once at import
+_INVALID_SIGNATURE_BODY = orjson.dumps({"status": "error", "message": "Invalid signature"})
+_INVALID_JSON_BODY = orjson.dumps({"status": "error", "message": "Invalid JSON payload"})
+_PING_BODY = orjson.dumps({"status": "ping received successfully"})
+_DUPLICATE_BODY = orjson.dumps({"status": "duplicate"})
+
+def _json_response(body, status=200):
+    """Wrap a pre-serialized JSON body in a new Response.
+
+    A fresh Response is built for each request, since Flask and any
+    after_request hooks may modify the response object.
+    """
+    return Response(body, status=status, mimetype="application/json")
+
+def _is_duplicate_delivery(delivery_id):
+    """Record a delivery ID and report whether it had already been seen.
+
+    Args:
+        delivery_id (str): The X-GitHub-Delivery header, or None if absent
+
+    Returns:
+        bool: True if the same delivery was received before
+    """
+    if not delivery_id:
+        return False
+
+    with _SEEN_DELIVERIES_LOCK:
+        if delivery_id in _SEEN_DELIVERIES:
+            return True
+        _SEEN_DELIVERIES[delivery_id] = time.time()
+        while len(_SEEN_DELIVERIES) > _SEEN_DELIVERIES_MAX_ENTRIES:
+            _SEEN_DELIVERIES.popitem(last=False)
+    return False
+
+def check_github_auth():
+    """Verify the GitHub PAT by fetching the authenticated user and log the result."""
+    try:
+        auth_response = conditional_get(f"{GITHUB_API_URL}/user")
+        if auth_response.status_code == 200:
+            username = orjson.loads(auth_response.content).get('login')
+            logger.info("Successfully authenticated with GitHub as: %s", username)
+        else:
+            logger.error("Failed to authenticate with GitHub: %s %s", auth_response.status_code, auth_response.text)
+    except Exception as e:
+        logger.exception("Error authenticating with GitHub: %s", e)
+
+def _run_job(job_id, func, args):
+    """Run an executor job, then release its in-flight entry."""
+    try:
+        func(*args)
+    finally:
+        if job_id is not None:
+            with _JOBS_IN_FLIGHT_LOCK:
+                _JOBS_IN_FLIGHT.discard(job_id)
+
+def run_in_background(job_id, func, *args):
+    """Run func(*args) after the webhook has been acknowledged.
+
+    The call goes to the RQ queue when REDIS_URL is set, and to the in-process
+    EXECUTOR otherwise. func must be a module-level function so RQ workers can
+    import it.
+
+    Args:
+        job_id (str): Identifies the work so the same job is not queued twice
+            while it is still pending, or None to always queue it
+        func (callable): The function to run
+        *args: Arguments for func
+
+    Returns:
+        bool: False if a job with the same ID is still queued or running
+    """
+    if JOB_QUEUE is not None:
+        rq_job_id = re.sub(r'[^A-Za-z0-9_-]', '_', job_id) if job_id is not None else None
+        if rq_job_id is not None:
+            job = JOB_QUEUE.fetch_job(rq_job_id)
+            if job is not None and job.get_status() in ("queued", "started", "deferred", "scheduled"):
+                return False
+        JOB_QUEUE.enqueue(func, *args, job_id=rq_job_id, job_timeout=JOB_TIMEOUT)
+        return True
+
+    if job_id is not None:
+        with _JOBS_IN_FLIGHT_LOCK:
+            if job_id in _JOBS_IN_FLIGHT:
+                return False
+            _JOBS_IN_FLIGHT.add(job_id)
+    EXECUTOR.submit(_run_job, job_id, func, args)
+    return True
+
+def start_auth_check():
+    """Run check_github_auth() in the background if BOT_CHECK_AUTH=1.
+
+    The server starts without waiting on GitHub. Under the Werkzeug reloader
+    the check runs only in the parent process, not again in every reloaded
+    child.
+    """
+    if CHECK_AUTH_ON_STARTUP and not os.getenv("WERKZEUG_RUN_MAIN"):
+        EXECUTOR.submit(check_github_auth)
+
+def create_app(index_message, event_handlers):
+    """Create a Flask app serving GitHub webhooks.
+
+    Args:
+        index_message (str): Text returned by the root endpoint
+        event_handlers (dict): Maps an X-GitHub-Event name to a handler that
+            takes the parsed payload and returns a Flask response
+
+    Returns:
+        Flask: The configured Flask app
+    """
+    blueprint = Blueprint('webhooks', __name__)
+
+    # Events worth reading; everything else is dropped before the body is read
+    accepted_events = frozenset(event_handlers) | {'ping'}
+
+    @blueprint.before_request
+    def require_valid_signature():
+        """Reject webhook deliveries whose signature does not match before any route runs."""
+        if request.method != 'POST':
+            return None
+
+        # Skip events this app does not handle without hashing or parsing their payload
+        event_type = request.headers.get('X-GitHub-Event')
+        if event_type not in accepted_events:
+            logger.debug("Ignoring unhandled event: %s", event_type)
+            return '', 204
+
+        logger.debug("Webhook received")
+
+        # Reject malformed signatures before reading or hashing the body
+        provided_digest = _parse_signature(request.headers.get('X-Hub-Signature-256'))
+        if provided_digest is None:
+            logger.warning("Signature verification failed!")
+            return _json_response(_INVALID_SIGNATURE_BODY, 401)
+
+        # Verify the signature while reading the body, and keep the body for the route
+        payload_body, digest = _read_signed_body()
+        if not hmac.compare_digest(digest, provided_digest):
+            logger.warning("Signature verification failed!")
+            return _json_response(_INVALID_SIGNATURE_BODY, 401)
+
+        logger.debug("Signature verified successfully.")
+
+        # GitHub retries deliveries that time out with the same delivery ID
+        delivery_id = request.headers.get('X-GitHub-Delivery')
+        if _is_duplicate_delivery(delivery_id):
+            logger.info("Ignoring duplicate delivery: %s", delivery_id)
+            return _json_response(_DUPLICATE_BODY)
+
+        g.payload_body = payload_body
+        return None
+
+    @blueprint.route('/', methods=['GET'])
+    def index():
+        """Root endpoint to check if the server is running."""
+        return index_message
+
+    @blueprint.route('/webhook', methods=['POST'])
+    def webhook():
+        """Webhook endpoint that receives GitHub events and dispatches them by event type."""
+        # Get the event type from the request headers
+        event_type = request.headers.get('X-GitHub-Event')
+        logger.info("Event type: %s", event_type)
+
+        # Handle ping event (sent when webhook is first configured)
+        if event_type == 'ping':
+            logger.info("Received ping event.")
+            return _json_response(_PING_BODY)
+
+        # Parse the payload
+        try:
+            payload = orjson.loads(g.payload_body)
+            logger.debug("Payload parsed successfully.")
+        except orjson.JSONDecodeError:
+            logger.warning("Failed to parse payload.")
+            return _json_response(_INVALID_JSON_BODY, 400)
+
+        # Handlers expect an object; a signed array or scalar is still malformed
+        if not isinstance(payload, dict):
+            logger.warning("Payload is not a JSON object.")
+            return _json_response(_INVALID_JSON_BODY, 400)
+
+        # Only handled events get this far, see require_valid_signature()
+        return event_handlers[event_type](payload)
+
+    app = Flask(__name__)
+    app.register_blueprint(blueprint)
+    return app
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Environment Loader - Reads the project's .env file once per process.
+
+The bots and the test scripts all need the settings in .env. They share this
+helper, which depends on nothing but python-dotenv, so the test scripts can
+use it without importing the bots.
+"""
+
+from dotenv import load_dotenv
+
+_loaded = False
+
+def load_env_once():
+    """Load the .env file into os.environ, unless it was already loaded in this process.
+
+    Variables that are already set in the environment are not overridden.
+    """
+    global _loaded
+    if not _loaded:
+        load_dotenv()
+        _loaded = True
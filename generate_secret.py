@@ -5,14 +5,12 @@ Utility script to generate a secure webhook secret and update the .env file.
 
 import os
 import secrets
-import string
-import re
-from dotenv import load_dotenv
+from dotenv import set_key
 
 def generate_secure_secret(length=32):
     """Generate a cryptographically secure random string."""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+    # Every 3 random bytes encode to 4 URL-safe base64 characters
+    return secrets.token_urlsafe(length * 3 // 4)
 
 def update_env_file(secret):
     """Update the .env file with the new webhook secret."""
@@ -23,24 +21,8 @@ def update_env_file(secret):
         print(f"Error: .env file not found at {env_path}")
         return False
     
-    # Read the current content
-    with open(env_path, 'r') as f:
-        content = f.read()
-    
-    # Replace the webhook secret placeholder or existing value
-    pattern = r'WEBHOOK_SECRET=.*'
-    replacement = f'WEBHOOK_SECRET={secret}'
-    
-    if re.search(pattern, content):
-        # Replace existing webhook secret
-        new_content = re.sub(pattern, replacement, content)
-    else:
-        # Add webhook secret if not present
-        new_content = content + f'\n{replacement}\n'
-    
-    # Write the updated content back to the file
-    with open(env_path, 'w') as f:
-        f.write(new_content)
+    # Replace the webhook secret line in place, or append it if not present
+    set_key(env_path, "WEBHOOK_SECRET", secret, quote_mode="never")
     
     return True
 
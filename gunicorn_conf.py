@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration for running the GitHub bots in production.
+
+Usage:
+    gunicorn -c gunicorn_conf.py app:app
+
+Set GUNICORN_WORKER_CLASS=gevent (after `pip install gevent`) to serve webhooks
+from greenlets instead of threads. Gunicorn monkey-patches the standard library
+before loading the app, so the bots' blocking `requests` calls yield to other
+greenlets while they wait on GitHub. The hooks below only import the bots in
+the workers, so the master loads nothing that would be imported unpatched.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = 4
+threads = 16  # Used by gthread workers
+worker_connections = 1000  # Used by gevent workers
+keepalive = 30
+# Webhook requests only verify, parse and queue, so a worker stuck for longer
+# than this is restarted; reviews run on the background pool and are not
+# bound by it
+timeout = 30
+# Webhooks are acknowledged before their review runs, so give a stopping
+# worker time to finish the reviews already queued on its background pool
+graceful_timeout = 120
+
+def post_worker_init(worker):
+    """Verify GitHub authentication once, in the first worker rather than in every worker.
+
+    The check runs after the fork, so the master never imports bot_common or
+    opens a GitHub connection that the workers would inherit.
+    """
+    import bot_common
+    # Kept on the worker for worker_exit, which Gunicorn may also call in the master
+    worker.bot_executor = bot_common.EXECUTOR
+    if worker.age == 1:
+        bot_common.start_auth_check()
+
+def worker_exit(server, worker):
+    """Wait for queued background work to finish before the worker exits."""
+    executor = getattr(worker, "bot_executor", None)
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -6,336 +6,377 @@ This bot listens for webhook events from GitHub, specifically for pull request e
 with the "opened" action, and adds AI-generated code review comments to the PR.
 """
 
-import os
-import hmac
-import hashlib
-import json
+import logging
+import re
+import orjson
 import requests
-import time
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify
 
 # Import the PR review module
 import pr_review
+from bot_common import GITHUB_API_URL, github_post, conditional_get, run_in_background, start_auth_check, create_app, _json_response, _DUPLICATE_BODY
 
-# Load environment variables
-load_dotenv()
-
-# Configuration
-GITHUB_PAT = os.getenv("GITHUB_PAT")
-if not GITHUB_PAT:
-    raise ValueError("GITHUB_PAT environment variable not set. Check your .env file.")
-
-WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
-if not WEBHOOK_SECRET:
-    raise ValueError("WEBHOOK_SECRET environment variable not set. Check your .env file.")
-
-# Initialize Flask app
-app = Flask(__name__)
-
-def verify_signature(payload_body, signature_header):
-    """Verify that the webhook payload was sent from GitHub by validating the signature."""
-    if not signature_header:
-        return False
-    
-    hash_object = hmac.new(
-        WEBHOOK_SECRET.encode('utf-8'),
-        msg=payload_body,
-        digestmod=hashlib.sha256
-    )
-    expected_signature = "sha256=" + hash_object.hexdigest()
-    
-    return hmac.compare_digest(expected_signature, signature_header)
+logger = logging.getLogger(__name__)
 
 def get_pr_files(repo_full_name, pr_number):
-    """Get the list of files in a pull request."""
-    url = f"https://api.github.com/repos/{repo_full_name}/pulls/{pr_number}/files"
-    headers = {
-        "Authorization": f"token {GITHUB_PAT}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    """Get the list of files in a pull request.
     
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to get PR files: {response.status_code} {response.text}")
+    Repeat fetches are served by the conditional GET cache in bot_common, so
+    an unchanged file list costs a 304 and does not count against the rate limit.
+    """
+    # Ask for the maximum page size and follow the Link header, so a PR with
+    # many files takes as few requests as possible and no files are missed
+    url = f"{GITHUB_API_URL}/repos/{repo_full_name}/pulls/{pr_number}/files?per_page=100"
+    files = []
+    try:
+        while url:
+            response = conditional_get(url)
+            response.raise_for_status()
+            files.extend(orjson.loads(response.content))
+            url = response.links.get('next', {}).get('url')
+    except requests.RequestException as e:
+        logger.error("Failed to get PR files: %s", e)
         return None
+    return files
 
-def get_file_content(repo_full_name, file_path, commit_sha):
-    """Get the content of a file at a specific commit."""
-    url = f"https://api.github.com/repos/{repo_full_name}/contents/{file_path}?ref={commit_sha}"
-    headers = {
-        "Authorization": f"token {GITHUB_PAT}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        content_data = response.json()
-        if content_data.get("encoding") == "base64":
-            import base64
-            content = base64.b64decode(content_data.get("content")).decode("utf-8")
-            return content
-        return None
-    else:
-        print(f"Failed to get file content: {response.status_code} {response.text}")
-        return None
+# Matches the first line that is neither blank nor starts with a comment marker
+_FIRST_CODE_LINE_RE = re.compile(r"^(?![^\S\n]*(?:#|//|/\*|\*|'))[^\n]*\S[^\n]*$", re.MULTILINE)
 
 def find_first_code_line(content):
-    """Find the first non-empty line of code in a file."""
+    """Find the first non-empty line of code in a file.
+    
+    Args:
+        content (str): The file content
+        
+    Returns:
+        dict: The 1-based 'line_number' and the line's 'content',
+            or None if the file has no code line
+    """
     if not content:
         return None
     
-    lines = content.split("\n")
-    for i, line in enumerate(lines):
-        # Skip empty lines and comment-only lines
-        stripped_line = line.strip()
-        if stripped_line and not stripped_line.startswith(("#", "//", "/*", "*", "'")):
-            return {
-                "line_number": i + 1,  # GitHub line numbers are 1-based
-                "content": line
-            }
+    # Skip empty lines and comment-only lines in a single regex scan
+    match = _FIRST_CODE_LINE_RE.search(content)
+    if not match:
+        return None
+    
+    return {
+        "line_number": content.count("\n", 0, match.start()) + 1,  # GitHub line numbers are 1-based
+        "content": match.group(0)
+    }
+
+def find_review_line(file_info):
+    """Find the line of a changed file to attach its review comment to.
+    
+    Uses the added lines parsed from the file's patch, so no file content has
+    to be downloaded. The first added line that is not blank or a comment is
+    preferred, falling back to the start of the first changed section.
+    
+    Args:
+        file_info (dict): File information from pr_review.analyze_pr_file()
+        
+    Returns:
+        int: Line number in the new version of the file, or None if the file
+            has no changed sections
+    """
+    changed_sections = file_info['changed_sections']
+    for section in changed_sections:
+        # Scan the section's added lines in one regex pass rather than line by line
+        first_code_line = find_first_code_line("\n".join(section['content']))
+        if first_code_line:
+            return section['changed_line_numbers'][first_code_line['line_number'] - 1]
     
-    return None
+    return changed_sections[0]['start_line'] if changed_sections else None
 
 def post_pr_review_comment(repo_full_name, pr_number, commit_id, path, position, body):
-    """Post a review comment on a specific line of code in a pull request."""
-    url = f"https://api.github.com/repos/{repo_full_name}/pulls/{pr_number}/comments"
-    headers = {
-        "Authorization": f"token {GITHUB_PAT}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    """Post a review comment on a specific line of code in a pull request.
+    
+    position is a line number in the new version of the file, as returned by
+    find_review_line.
+    """
+    api_path = f"/repos/{repo_full_name}/pulls/{pr_number}/comments"
     data = {
         "commit_id": commit_id,
         "path": path,
-        "position": position,  # Line number in the diff
+        "line": position,
+        "side": "RIGHT",
         "body": body
     }
     
-    response = requests.post(url, headers=headers, json=data)
+    response = github_post(api_path, data)
     
     if response.status_code == 201:
-        print(f"Successfully posted review comment on PR #{pr_number} in {repo_full_name}")
+        logger.info("Successfully posted review comment on PR #%s in %s", pr_number, repo_full_name)
         return True
     else:
-        print(f"Failed to post review comment: {response.status_code} {response.text}")
+        logger.error("Failed to post review comment: %s %s", response.status_code, response.text)
         return False
 
 def post_pr_comment(repo_full_name, pr_number, comment_body):
     """Post a general comment on a GitHub pull request."""
-    url = f"https://api.github.com/repos/{repo_full_name}/issues/{pr_number}/comments"
-    headers = {
-        "Authorization": f"token {GITHUB_PAT}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    path = f"/repos/{repo_full_name}/issues/{pr_number}/comments"
     data = {"body": comment_body}
     
-    response = requests.post(url, headers=headers, json=data)
+    response = github_post(path, data)
     
     if response.status_code == 201:
-        print(f"Successfully posted comment on PR #{pr_number} in {repo_full_name}")
+        logger.info("Successfully posted comment on PR #%s in %s", pr_number, repo_full_name)
         return True
     else:
-        print(f"Failed to post comment: {response.status_code} {response.text}")
+        logger.error("Failed to post comment: %s %s", response.status_code, response.text)
         return False
 
-@app.route('/', methods=['GET'])
-def index():
-    """Root endpoint to check if the server is running."""
-    return "Local GitHub PR Bot is running!"
-
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Webhook endpoint that receives GitHub events."""
-    # Get the signature from the request headers
-    signature_header = request.headers.get('X-Hub-Signature-256')
+def post_pr_review(repo_full_name, pr_number, commit_id, comments):
+    """Post several line comments on a pull request as a single review.
     
-    # Get the event type from the request headers
-    event_type = request.headers.get('X-GitHub-Event')
+    Args:
+        repo_full_name (str): Full name of the repository (owner/repo)
+        pr_number (int): Pull request number
+        commit_id (str): SHA of the commit the comments refer to
+        comments (list): Review comments, each a dict with 'path', 'line' and 'body'
+        
+    Returns:
+        bool: True if the review was posted
+    """
+    path = f"/repos/{repo_full_name}/pulls/{pr_number}/reviews"
+    data = {
+        "commit_id": commit_id,
+        "event": "COMMENT",
+        "comments": [
+            {"path": c["path"], "line": c["line"], "side": "RIGHT", "body": c["body"]}
+            for c in comments
+        ]
+    }
     
-    # Get the payload body
-    payload_body = request.data
+    response = github_post(path, data)
     
-    print("\n--- Webhook Received ---")
+    if response.status_code == 200:
+        logger.info("Successfully posted review with %d comment(s) on PR #%s in %s", len(comments), pr_number, repo_full_name)
+        return True
+    else:
+        logger.error("Failed to post review: %s %s", response.status_code, response.text)
+        return False
+
+def _format_file_review(review_data):
+    """Format the AI review of one file as a comment body."""
+    return f"# AI Code Review for `{review_data['file']['path']}`\n\n{review_data['review']}"
+
+def _post_file_review(repo_full_name, pr_number, head_sha, review_data):
+    """Post the review of one file, falling back to a general PR comment.
     
-    # Verify the signature
-    if not verify_signature(payload_body, signature_header):
-        print("Signature verification failed!")
-        return jsonify({"status": "error", "message": "Invalid signature"}), 401
+    Returns:
+        bool: True if the review was posted in either form
+    """
+    file_info = review_data['file']
+    file_path = file_info['path']
     
-    print("Signature verified successfully.")
-    print(f"Event type: {event_type}")
+    logger.debug("Posting review for file: %s", file_path)
     
-    # Handle ping event (sent when webhook is first configured)
-    if event_type == 'ping':
-        print("Received ping event.")
-        return jsonify({"status": "ping received successfully"})
+    # Post the AI-generated review as a comment on the PR
+    comment = _format_file_review(review_data)
     
-    # Parse the payload
-    try:
-        payload = json.loads(payload_body)
-        print("Payload parsed successfully.")
-    except json.JSONDecodeError:
-        print("Failed to parse payload.")
-        return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
+    # First, try to post the review on the first changed line of code
+    line_number = find_review_line(file_info)
+    if line_number is not None:
+        if post_pr_review_comment(repo_full_name, pr_number, head_sha, file_path, line_number, comment):
+            return True
+    
+    # If there is no changed section or the review comment failed, post a general comment
+    return post_pr_comment(repo_full_name, pr_number, comment)
+
+def _parse_pull_request(payload):
+    """Pull the fields the review needs out of a pull_request event payload.
     
-    # Handle pull request event
-    if event_type == 'pull_request':
-        # Check if the action is 'opened' (new PR)
-        action = payload.get('action')
-        print(f"Action: {action}")
+    The payload is walked once here, so the rest of the bot works with plain
+    values instead of repeated chained lookups.
+    
+    Args:
+        payload (dict): The parsed pull_request webhook payload
         
-        if action == 'opened':
-            # Get repository, PR number, and PR creator information
-            repo_full_name = payload.get('repository', {}).get('full_name')
-            pr_number = payload.get('number')
-            pr_creator = payload.get('pull_request', {}).get('user', {}).get('login')
-            pr_title = payload.get('pull_request', {}).get('title')
-            pr_body = payload.get('pull_request', {}).get('body', '')
-            head_sha = payload.get('pull_request', {}).get('head', {}).get('sha')
-            base_branch = payload.get('pull_request', {}).get('base', {}).get('ref', 'main')
-            head_branch = payload.get('pull_request', {}).get('head', {}).get('ref')
-            
-            print(f"Received new PR #{pr_number} in {repo_full_name} by {pr_creator}")
-            print(f"PR Title: '{pr_title}'")
-            print(f"Base branch: {base_branch}, Head branch: {head_branch}")
-            
-            try:
-                # First, get the list of files in the PR
-                pr_files = get_pr_files(repo_full_name, pr_number)
-                
-                if not pr_files or len(pr_files) == 0:
-                    print("No files found in the PR. Posting a general comment instead.")
-                    # Post a general comment if no files are found
-                    success = post_pr_comment(repo_full_name, pr_number, "PR Comment by Bot - No files found to review")
-                    if success:
-                        return jsonify({"status": "success", "message": "General comment posted on PR"})
-                    else:
-                        return jsonify({"status": "error", "message": "Failed to post general comment"}), 500
-                
-                # Post an initial comment to let the user know the bot is reviewing the PR
-                initial_comment = (
-                    "# 🤖 AI Code Review in Progress\n\n"
-                    "I'm analyzing your pull request and will provide a detailed code review shortly.\n\n"
-                    f"Reviewing {len(pr_files)} file(s) changed in this PR.\n\n"
-                    "Please wait while I process the code..."
-                )
-                post_pr_comment(repo_full_name, pr_number, initial_comment)
-                
-                # Prepare PR info for the review
-                pr_info = {
-                    'title': pr_title,
-                    'description': pr_body,
-                    'author': pr_creator,
-                    'number': pr_number
-                }
-                
-                # Generate AI reviews for each file in the PR
-                print(f"Generating AI reviews for {len(pr_files)} files...")
-                reviews = pr_review.review_pr_files(
-                    repo_full_name, 
-                    pr_number, 
-                    pr_files, 
-                    base_branch, 
-                    head_branch, 
-                    pr_info
-                )
-                
-                # Post review comments for each file
-                success_count = 0
-                failure_count = 0
-                
-                for review_data in reviews:
-                    file_info = review_data['file']
-                    review_content = review_data['review']
-                    file_path = file_info['path']
-                    
-                    print(f"Posting review for file: {file_path}")
-                    
-                    # Post the AI-generated review as a comment on the PR
-                    comment = f"# AI Code Review for `{file_path}`\n\n{review_content}"
-                    
-                    # First, try to post the review on the first line of the first changed section
-                    if file_info['changed_sections'] and len(file_info['changed_sections']) > 0:
-                        first_section = file_info['changed_sections'][0]
-                        line_number = first_section['start_line']
-                        
-                        success = post_pr_review_comment(
-                            repo_full_name,
-                            pr_number,
-                            head_sha,
-                            file_path,
-                            line_number,
-                            comment
-                        )
-                        
-                        if success:
-                            success_count += 1
-                        else:
-                            # If posting as a review comment fails, post as a general comment
-                            general_success = post_pr_comment(repo_full_name, pr_number, comment)
-                            if general_success:
-                                success_count += 1
-                            else:
-                                failure_count += 1
-                    else:
-                        # If no changed sections were identified, post as a general comment
-                        general_success = post_pr_comment(repo_full_name, pr_number, comment)
-                        if general_success:
-                            success_count += 1
-                        else:
-                            failure_count += 1
-                    
-                    # Add a small delay to avoid rate limiting
-                    time.sleep(1)
-                
-                # Post a summary comment
-                summary = (
-                    "# 🤖 AI Code Review Complete\n\n"
-                    f"I've reviewed {len(reviews)} file(s) in this pull request.\n\n"
-                    f"- Successfully posted {success_count} review comment(s)\n"
-                    f"- Failed to post {failure_count} review comment(s)\n\n"
-                    "Please review the comments and make any necessary changes. "
-                    "If you have any questions about the review, feel free to ask!"
-                )
-                post_pr_comment(repo_full_name, pr_number, summary)
-                
-                return jsonify({
-                    "status": "success", 
-                    "message": f"Posted {success_count} review comments on PR",
-                    "failures": failure_count
-                })
-            except Exception as e:
-                error_message = f"Failed to interact with GitHub API: {str(e)}"
-                print(error_message)
-                return jsonify({"status": "error", "message": error_message}), 500
-        else:
-            print(f"PR action '{action}' does not require a response.")
-            return jsonify({"status": "ignored", "reason": f"PR action '{action}' does not require a response"})
+    Returns:
+        dict: The PR fields, or None if a required field is missing or malformed
+    """
+    repository = payload.get('repository')
+    pull_request = payload.get('pull_request')
+    if not isinstance(repository, dict) or not isinstance(pull_request, dict):
+        return None
     
-    # For any other event or action, just acknowledge receipt
-    return jsonify({"status": "acknowledged", "event": event_type})
-
-if __name__ == '__main__':
-    # Verify GitHub authentication
-    auth_headers = {
-        "Authorization": f"token {GITHUB_PAT}",
-        "Accept": "application/vnd.github.v3+json"
+    head = pull_request.get('head')
+    base = pull_request.get('base')
+    if not isinstance(head, dict) or not isinstance(base, dict):
+        return None
+    
+    # The author is only logged and shown in the review, so it may be missing
+    user = pull_request.get('user')
+    if not isinstance(user, dict):
+        user = {}
+    pr = {
+        'repo_full_name': repository.get('full_name'),
+        'number': payload.get('number'),
+        'creator': user.get('login'),
+        'title': pull_request.get('title'),
+        'body': pull_request.get('body') or '',
+        'head_sha': head.get('sha'),
+        'head_branch': head.get('ref'),
+        'base_branch': base.get('ref', 'main')
     }
     
+    # These identify the PR and the commit to review; without them there is nothing to do
+    if (not isinstance(pr['repo_full_name'], str) or not isinstance(pr['number'], int)
+            or not isinstance(pr['head_sha'], str) or not isinstance(pr['head_branch'], str)
+            or not isinstance(pr['base_branch'], str)):
+        return None
+    
+    return pr
+
+def _process_pull_request(pr):
+    """Review a newly opened pull request and post the results as comments.
+
+    Runs on the background worker pool, so failures are logged rather than
+    returned to GitHub.
+    
+    Args:
+        pr (dict): PR fields from _parse_pull_request()
+    """
+    repo_full_name = pr['repo_full_name']
+    pr_number = pr['number']
+    pr_creator = pr['creator']
+    pr_title = pr['title']
+    pr_body = pr['body']
+    head_sha = pr['head_sha']
+    base_branch = pr['base_branch']
+    head_branch = pr['head_branch']
+    
+    logger.info("Received new PR #%s in %s by %s", pr_number, repo_full_name, pr_creator)
+    logger.debug("PR Title: '%s'", pr_title)
+    logger.debug("Base branch: %s, Head branch: %s", base_branch, head_branch)
+    
     try:
-        auth_response = requests.get("https://api.github.com/user", headers=auth_headers)
-        if auth_response.status_code == 200:
-            username = auth_response.json().get('login')
-            print(f"Successfully authenticated with GitHub as: {username}")
+        # First, get the list of files in the PR
+        pr_files = get_pr_files(repo_full_name, pr_number)
+        
+        if not pr_files or len(pr_files) == 0:
+            logger.info("No files found in the PR. Posting a general comment instead.")
+            # Post a general comment if no files are found
+            if not post_pr_comment(repo_full_name, pr_number, "PR Comment by Bot - No files found to review"):
+                logger.error("Failed to post general comment on PR #%s", pr_number)
+            return
+        
+        # Post an initial comment to let the user know the bot is reviewing the PR
+        initial_comment = (
+            "# 🤖 AI Code Review in Progress\n\n"
+            "I'm analyzing your pull request and will provide a detailed code review shortly.\n\n"
+            f"Reviewing {len(pr_files)} file(s) changed in this PR.\n\n"
+            "Please wait while I process the code..."
+        )
+        post_pr_comment(repo_full_name, pr_number, initial_comment)
+        
+        # Prepare PR info for the review
+        pr_info = {
+            'title': pr_title,
+            'description': pr_body,
+            'author': pr_creator,
+            'number': pr_number
+        }
+        
+        # Generate AI reviews for each file in the PR
+        logger.info("Generating AI reviews for %d files...", len(pr_files))
+        reviews = pr_review.review_pr_files(
+            repo_full_name, 
+            pr_number, 
+            pr_files, 
+            base_branch, 
+            head_branch, 
+            pr_info,
+            head_sha=head_sha
+        )
+        
+        # Anchor each file's review on its first changed line of code, and
+        # post all of them together as one pull request review
+        review_comments = []
+        remaining = []
+        for review_data in reviews:
+            line_number = find_review_line(review_data['file'])
+            if line_number is None:
+                remaining.append(review_data)
+            else:
+                review_comments.append({
+                    "path": review_data['file']['path'],
+                    "line": line_number,
+                    "body": _format_file_review(review_data)
+                })
+        
+        if review_comments and post_pr_review(repo_full_name, pr_number, head_sha, review_comments):
+            success_count = len(review_comments)
         else:
-            print(f"Failed to authenticate with GitHub: {auth_response.status_code} {auth_response.text}")
+            # Fall back to posting every file's review on its own
+            success_count = 0
+            remaining = reviews
+        
+        # Post the remaining reviews concurrently; the shared rate limiter
+        # keeps the combined request rate within GitHub's limits
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [
+                pool.submit(_post_file_review, repo_full_name, pr_number, head_sha, review_data)
+                for review_data in remaining
+            ]
+            results = [future.result() for future in futures]
+        
+        success_count += sum(results)
+        failure_count = len(reviews) - success_count
+        
+        # Post a summary comment
+        summary = (
+            "# 🤖 AI Code Review Complete\n\n"
+            f"I've reviewed {len(reviews)} file(s) in this pull request.\n\n"
+            f"- Successfully posted {success_count} review comment(s)\n"
+            f"- Failed to post {failure_count} review comment(s)\n\n"
+            "Please review the comments and make any necessary changes. "
+            "If you have any questions about the review, feel free to ask!"
+        )
+        post_pr_comment(repo_full_name, pr_number, summary)
+        
+        logger.info("Posted %d review comments on PR #%s (%d failures)", success_count, pr_number, failure_count)
     except Exception as e:
-        print(f"Error authenticating with GitHub: {str(e)}")
+        logger.exception("Failed to interact with GitHub API: %s", e)
+
+def handle_pull_request(payload):
+    """Handle a pull_request event, queueing an AI review for newly opened PRs."""
+    # Check if the action is 'opened' (new PR)
+    action = payload.get('action')
+    logger.debug("Action: %s", action)
+    
+    if action == 'opened':
+        pr = _parse_pull_request(payload)
+        if pr is None:
+            logger.warning("Malformed pull_request payload.")
+            return jsonify({"status": "error", "message": "Malformed pull_request payload"}), 400
+        
+        # Review the PR in the background and acknowledge the webhook right away.
+        # Keying the job on the head commit means two deliveries for the same
+        # commit never review it twice at the same time.
+        review_id = f"review-{pr['repo_full_name']}-{pr['number']}-{pr['head_sha']}"
+        if not run_in_background(review_id, _process_pull_request, pr):
+            logger.info("Review of %s#%s at %s is already in progress", pr['repo_full_name'], pr['number'], pr['head_sha'])
+            return _json_response(_DUPLICATE_BODY)
+        return jsonify({"status": "queued"}), 202
+    else:
+        logger.debug("PR action '%s' does not require a response.", action)
+        return jsonify({"status": "ignored", "reason": f"PR action '{action}' does not require a response"})
+
+# Webhook events handled by this bot, keyed by X-GitHub-Event
+EVENT_HANDLERS = {
+    'pull_request': handle_pull_request
+}
+
+# Initialize Flask app
+app = create_app("Local GitHub PR Bot is running!", EVENT_HANDLERS)
+
+if __name__ == '__main__':
+    # Verify GitHub authentication in the background if enabled
+    start_auth_check()
     
     # Start the Flask server on a different port than the Issue Bot
-    print("Starting PR Bot Flask server on http://localhost:5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    logger.info("Starting PR Bot Flask server on http://localhost:5001")
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
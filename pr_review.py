@@ -4,74 +4,228 @@ GitHub PR Review Module - Provides functionality for reviewing pull requests usi
 
 This module handles repository cloning, diff analysis, and integration with the Anthropic API
 to generate code reviews for pull requests.
+
+Repositories are cloned under REPOS_CACHE_DIR (default: .repos in the working directory)
+and reused across reviews. In container deployments, mount a persistent volume there so
+restarts do not have to clone every repository again.
 """
 
+import contextlib
+import functools
+import io
+import logging
 import os
+import re
 import subprocess
+import threading
+import time
 import base64
-import tempfile
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from anthropic import Anthropic
-from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from env_loader import load_env_once
+from review_cache import ReviewCache, review_cache_key
 
 # Load environment variables
-load_dotenv()
+load_env_once()
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.rabbithole.cred.club")
 ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-7-sonnet-20250219")
 GITHUB_PAT = os.getenv("GITHUB_PAT")
+REPOS_CACHE_DIR = os.getenv("REPOS_CACHE_DIR", ".repos")
+
+# AI reviews of identical changes are reused across PRs
+REVIEW_CACHE = ReviewCache(os.path.join(REPOS_CACHE_DIR, "reviews.db"))
+# Part of the review cache key; bump it whenever the review prompt changes
+PROMPT_VERSION = "4"
+
+# Environment for git commands: never prompt for credentials (which would block
+# a worker), and authenticate to GitHub with the PAT through an HTTP header so
+# the token is not written into the clone URL or .git/config
+_GIT_ENV = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+if GITHUB_PAT:
+    _GIT_ENV.update({
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "http.https://github.com/.extraheader",
+        "GIT_CONFIG_VALUE_0": "AUTHORIZATION: basic " + base64.b64encode(f"x-access-token:{GITHUB_PAT}".encode()).decode()
+    })
+# Files are reviewed concurrently, at most this many Anthropic calls at a time
+# across every PR being reviewed by this process
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "8"))
+_ANTHROPIC_SEMAPHORE = threading.BoundedSemaphore(ANTHROPIC_MAX_CONCURRENCY)
+# Rate limited (429) and overloaded calls are retried with exponential backoff
+ANTHROPIC_MAX_RETRIES = int(os.getenv("ANTHROPIC_MAX_RETRIES", "5"))
+# A single file review that streams for longer than this many seconds is
+# abandoned in favour of the fallback review
+ANTHROPIC_REVIEW_TIMEOUT = float(os.getenv("ANTHROPIC_REVIEW_TIMEOUT", "120"))
+
+# Files with these extensions are documentation, data, lock files or binaries,
+# and are not sent for an AI code review
+SKIP_REVIEW_EXTENSIONS = frozenset({
+    '.md', '.txt', '.json', '.yaml', '.yml', '.lock', '.csv', '.xml',
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.pdf',
+    '.wasm', '.so', '.dll', '.exe', '.zip', '.gz', '.woff', '.woff2', '.ttf'
+})
+# Files with these names or suffixes are lock files or generated code
+SKIP_REVIEW_FILENAMES = frozenset({'go.sum'})
+SKIP_REVIEW_SUFFIXES = ('_pb2.py', '_pb2_grpc.py', '.pb.go', '.generated.ts')
+# Files under these directories are vendored or build output
+SKIP_REVIEW_DIRECTORIES = frozenset({'node_modules', 'dist', 'build', 'vendor'})
+# Files with more changed lines than this are too large to review usefully
+MAX_REVIEW_CHANGES = int(os.getenv("MAX_REVIEW_CHANGES", "2000"))
+# Files gaining this many lines at once are almost always generated or vendored
+MAX_REVIEW_ADDITIONS = int(os.getenv("MAX_REVIEW_ADDITIONS", "1500"))
 
 # Initialize Anthropic client
+@functools.lru_cache(maxsize=1)
 def initialize_anthropic_client():
-    """Initialize the Anthropic client with configuration from environment variables."""
+    """Initialize the Anthropic client with configuration from environment variables.
+    
+    The client is created once and shared, so every review reuses its
+    connection pool; it is safe to use from several threads.
+    """
     try:
         # Try with just the required parameters
         return Anthropic(
             api_key=ANTHROPIC_API_KEY,
-            base_url=ANTHROPIC_BASE_URL
+            base_url=ANTHROPIC_BASE_URL,
+            max_retries=ANTHROPIC_MAX_RETRIES
         )
     except TypeError as e:
         # If there's a TypeError, it might be due to parameter issues
-        print(f"Error initializing Anthropic client with base_url: {e}")
+        logger.warning("Error initializing Anthropic client with base_url: %s", e)
         # Try without base_url if that's causing issues
-        return Anthropic(api_key=ANTHROPIC_API_KEY)
+        return Anthropic(api_key=ANTHROPIC_API_KEY, max_retries=ANTHROPIC_MAX_RETRIES)
 
-def clone_repository(repo_full_name, branch="main"):
-    """Clone a GitHub repository to the local .repos directory.
+def get_head_sha(repo_dir):
+    """Get the SHA of the commit checked out in a local repository.
+    
+    Args:
+        repo_dir (str): Path to the repository
+        
+    Returns:
+        str: The HEAD commit SHA, or None if it cannot be resolved
+    """
+    result = subprocess.run(
+        ["git", "-C", repo_dir, "rev-parse", "HEAD"],
+        capture_output=True,
+        text=True,
+        env=_GIT_ENV
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+# In-process locks per repository, taken before the file lock; see repository_lock
+_REPOSITORY_LOCKS = {}
+_REPOSITORY_LOCKS_LOCK = threading.Lock()
+
+@contextlib.contextmanager
+def repository_lock(repo_full_name):
+    """Hold an exclusive lock on a repository under REPOS_CACHE_DIR.
+    
+    Webhook workers (threads or processes) share one working copy per
+    repository, so the lock is held while a PR is checked out and read.
+    Reviews in the same process first wait on a per-repository
+    threading.Lock, which gevent patches, so a waiting greenlet never blocks
+    the one holding the lock. Across processes the lock is a flock on
+    REPOS_CACHE_DIR/<owner>_<repo>.lock, taken without blocking and retried
+    with time.sleep for the same reason; it is released when the file is
+    closed, so it also goes away if the process dies. On platforms without
+    fcntl only the in-process lock is taken.
+    
+    Args:
+        repo_full_name (str): The full name of the repository (e.g., "username/repo")
+    """
+    with _REPOSITORY_LOCKS_LOCK:
+        process_lock = _REPOSITORY_LOCKS.setdefault(repo_full_name, threading.Lock())
+    
+    with process_lock:
+        os.makedirs(REPOS_CACHE_DIR, exist_ok=True)
+        lock_path = os.path.join(REPOS_CACHE_DIR, repo_full_name.replace("/", "_") + ".lock")
+        with open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        time.sleep(0.1)
+            yield
+
+def clone_repository(repo_full_name, pr_number, base_branch="main", head_sha=None, paths=None):
+    """Fetch a pull request into a local repository under REPOS_CACHE_DIR.
+    
+    Only the PR's head (refs/pull/<number>/head, which also works for PRs from
+    forks) and its base branch are fetched, and the head commit is checked
+    out detached; the base branch is available as origin/<base_branch>.
+    Callers must hold repository_lock for as long as they use the checkout.
     
     Args:
         repo_full_name (str): The full name of the repository (e.g., "username/repo")
-        branch (str): The branch to checkout (default: "main")
+        pr_number (int): The pull request number
+        base_branch (str): The branch the PR targets (default: "main")
+        head_sha (str): The PR head commit to check out; if the existing
+            repository already has it checked out, nothing is fetched
+        paths (list): If given, only these files are checked out (a sparse
+            checkout); other blobs are fetched lazily if git needs them
         
     Returns:
-        str: The path to the cloned repository
+        str: The path to the local repository
     """
-    repo_dir = os.path.join(".repos", repo_full_name.replace("/", "_"))
-    
-    # Create .repos directory if it doesn't exist
-    if not os.path.exists(".repos"):
-        os.makedirs(".repos")
-    
-    if os.path.exists(repo_dir):
-        # Update existing repository
-        print(f"Updating existing repository: {repo_full_name}")
-        subprocess.run(["git", "-C", repo_dir, "fetch", "--all"], check=True)
-        subprocess.run(["git", "-C", repo_dir, "checkout", branch], check=True)
-        subprocess.run(["git", "-C", repo_dir, "pull"], check=True)
-    else:
-        # Clone new repository
-        print(f"Cloning repository: {repo_full_name}")
+    repo_dir = os.path.join(REPOS_CACHE_DIR, repo_full_name.replace("/", "_"))
+    
+    # Create the cache directory if it doesn't exist
+    os.makedirs(REPOS_CACHE_DIR, exist_ok=True)
+    
+    if not os.path.exists(repo_dir):
+        logger.info("Creating repository: %s", repo_full_name)
         clone_url = f"https://github.com/{repo_full_name}.git"
-        subprocess.run(["git", "clone", clone_url, repo_dir], check=True)
-        subprocess.run(["git", "-C", repo_dir, "checkout", branch], check=True)
+        subprocess.run(["git", "init", "-q", repo_dir], check=True, env=_GIT_ENV)
+        subprocess.run(["git", "-C", repo_dir, "remote", "add", "origin", clone_url], check=True, env=_GIT_ENV)
+    
+    if paths:
+        # Only write the files under review to the working tree; anchored
+        # non-cone patterns match exactly the given files
+        sparse_patterns = [f"/{path}" for path in paths]
+        subprocess.run(["git", "-C", repo_dir, "sparse-checkout", "set", "--no-cone", *sparse_patterns], check=True, env=_GIT_ENV)
+    
+    # Nothing to fetch if the repository is already at the commit being reviewed
+    if head_sha and get_head_sha(repo_dir) == head_sha:
+        logger.debug("Repository %s is already at %s", repo_full_name, head_sha)
+        return repo_dir
+    
+    # Fetch history and trees but no tags or file contents; blobs are
+    # downloaded when they are checked out or diffed
+    logger.info("Fetching PR #%s of %s", pr_number, repo_full_name)
+    subprocess.run(
+        ["git", "-C", repo_dir, "fetch", "--no-tags", "--filter=blob:none", "origin",
+         f"+refs/pull/{pr_number}/head:refs/pull/{pr_number}/head",
+         f"+refs/heads/{base_branch}:refs/remotes/origin/{base_branch}"],
+        check=True,
+        env=_GIT_ENV
+    )
+    subprocess.run(
+        ["git", "-C", repo_dir, "checkout", "-q", "--detach", head_sha or f"refs/pull/{pr_number}/head"],
+        check=True,
+        env=_GIT_ENV
+    )
     
     return repo_dir
 
 def get_file_diff(repo_dir, file_path, base_branch="main", head_branch="HEAD"):
     """Get the diff for a specific file between two branches.
     
+    Like GitHub, this diffs the head against its merge base with the base
+    branch, so changes made on the base since then are not included.
+    
     Args:
         repo_dir (str): Path to the repository
         file_path (str): Path to the file
@@ -81,23 +235,71 @@ def get_file_diff(repo_dir, file_path, base_branch="main", head_branch="HEAD"):
     Returns:
         str: The diff output for the file
     """
-    try:
-        result = subprocess.run(
-            ["git", "-C", repo_dir, "diff", f"{base_branch}..{head_branch}", "--", file_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"Error getting diff for {file_path}: {e}")
+    result = subprocess.run(
+        ["git", "-C", repo_dir, "diff", "--no-color", "--no-ext-diff", f"{base_branch}...{head_branch}", "--", file_path],
+        capture_output=True,
+        env=_GIT_ENV
+    )
+    if result.returncode != 0:
+        logger.warning("Error getting diff for %s: %s", file_path, result.stderr.decode('utf-8', errors='replace').strip())
         return None
+    
+    # Decode once here rather than through the locale's codec; source
+    # files that are not valid UTF-8 must not fail the whole review
+    return result.stdout.decode('utf-8', errors='replace')
+
+# Matches a hunk header, capturing the start line and line count of the new file
+_HUNK_HEADER_PATTERN = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+# Matches the "diff --git a/<old> b/<new>" header of each file in a combined diff
+_DIFF_HEADER_PATTERN = re.compile(r'^a/(.+) b/(.+)$')
+
+def get_full_pr_diff(repo_dir, base_branch="main", head_branch="HEAD", paths=None):
+    """Get the diff of every file between two branches with a single git call.
+    
+    Like get_file_diff, this diffs the head against its merge base with the
+    base branch.
+    
+    Args:
+        repo_dir (str): Path to the repository
+        base_branch (str): Base branch for comparison
+        head_branch (str): Head branch for comparison
+        paths (list): If given, only these files are diffed
+        
+    Returns:
+        dict: Diff output keyed by file path (empty if the diff failed)
+    """
+    result = subprocess.run(
+        ["git", "-C", repo_dir, "--literal-pathspecs", "-c", "core.quotePath=false", "diff", "--no-color", "--no-ext-diff",
+         # The headers are split on these prefixes, so override diff.noprefix and diff.mnemonicPrefix
+         "--src-prefix=a/", "--dst-prefix=b/",
+         f"{base_branch}...{head_branch}", "--", *(paths or [])],
+        capture_output=True,
+        env=_GIT_ENV
+    )
+    if result.returncode != 0:
+        logger.warning(
+            "Error getting diff for %s...%s: %s",
+            base_branch, head_branch, result.stderr.decode('utf-8', errors='replace').strip()
+        )
+        return {}
+    
+    # Decode once, as in get_file_diff
+    output = result.stdout.decode('utf-8', errors='replace')
+    
+    diffs = {}
+    for chunk in ("\n" + output).split("\ndiff --git ")[1:]:
+        header = chunk.split("\n", 1)[0]
+        match = _DIFF_HEADER_PATTERN.match(header)
+        if match:
+            diffs[match.group(2)] = "diff --git " + chunk.rstrip("\n") + "\n"
+    return diffs
 
 def identify_changed_sections(diff_output):
     """Parse a git diff output to identify changed sections of code.
     
     Args:
-        diff_output (str): Git diff output
+        diff_output (str or iterable): Git diff output, or an iterable of its lines
         
     Returns:
         list: List of dictionaries containing information about changed sections
@@ -105,52 +307,43 @@ def identify_changed_sections(diff_output):
     if not diff_output:
         return []
     
+    # Walk the lines lazily rather than splitting the whole diff up front
+    if isinstance(diff_output, str):
+        diff_output = io.StringIO(diff_output)
+    
     sections = []
     current_section = None
     current_line_number = 0
     
-    for line in diff_output.split('\n'):
+    for line in diff_output:
+        line = line.rstrip('\n')
         if line.startswith('@@'):
             # Parse the @@ -a,b +c,d @@ line to get line numbers
-            parts = line.split(' ')
-            if len(parts) >= 3:
-                # Extract the +c,d part
-                added_info = parts[2]
-                if added_info.startswith('+'):
-                    line_info = added_info[1:].split(',')
-                    start_line = int(line_info[0])
-                    count = int(line_info[1]) if len(line_info) > 1 else 1
-                    
-                    if current_section:
-                        sections.append(current_section)
-                    
-                    current_section = {
-                        'start_line': start_line,
-                        'end_line': start_line + count - 1,
-                        'content': [],
-                        'header': line,
-                        'changed_lines': []  # Track individual changed lines
-                    }
-                    current_line_number = start_line
+            match = _HUNK_HEADER_PATTERN.match(line)
+            if match:
+                start_line = int(match.group(1))
+                count = int(match.group(2) or 1)
+                
+                if current_section:
+                    sections.append(current_section)
+                
+                current_section = {
+                    'start_line': start_line,
+                    'end_line': start_line + count - 1,
+                    'content': [],  # Added lines
+                    'header': line,
+                    'changed_line_numbers': []  # Line number of each entry in 'content'
+                }
+                current_line_number = start_line
         elif current_section is not None:
-            if line.startswith('+') and not line.startswith('+++'):
+            marker = line[:1]
+            if marker == '+' and not line.startswith('+++'):
                 # This is an added line
                 current_section['content'].append(line[1:])
-                # Track the specific line with its content
-                current_section['changed_lines'].append({
-                    'line_number': current_line_number,
-                    'content': line[1:],
-                    'type': 'added'
-                })
-            elif line.startswith(' '):
-                # This is an unchanged line
-                pass
-            elif not line.startswith('-'):
-                # This is not a removed line, so increment the line counter
-                pass
+                current_section['changed_line_numbers'].append(current_line_number)
             
             # Increment line number for non-removed lines
-            if not line.startswith('-'):
+            if marker != '-':
                 current_line_number += 1
     
     if current_section:
@@ -158,6 +351,12 @@ def identify_changed_sections(diff_output):
     
     return sections
 
+# Python import statements, and the frameworks detected from them (in report order)
+_PYTHON_IMPORT_PATTERN = re.compile(r'^[ \t]*((?:import|from) .*?)\s*$', re.MULTILINE)
+_PYTHON_FRAMEWORKS = ('flask', 'django', 'pandas', 'numpy', 'tensorflow', 'torch')
+_PYTHON_FRAMEWORK_PATTERN = re.compile(r'(?:import|from)\s+(' + '|'.join(_PYTHON_FRAMEWORKS) + r')\b', re.IGNORECASE)
+_PYTHON_FRAMEWORK_NAMES = {'torch': 'pytorch'}
+
 def analyze_code_patterns(file_content, file_path):
     """Analyze code patterns to identify the technology stack and common patterns.
     
@@ -181,26 +380,15 @@ def analyze_code_patterns(file_content, file_path):
     if ext == 'py':
         tech_info['language'] = 'python'
         
-        # Look for common Python frameworks
-        if 'import flask' in file_content.lower() or 'from flask import' in file_content.lower():
-            tech_info['frameworks'].append('flask')
-        if 'import django' in file_content.lower() or 'from django import' in file_content.lower():
-            tech_info['frameworks'].append('django')
-        if 'import pandas' in file_content.lower() or 'from pandas import' in file_content.lower():
-            tech_info['frameworks'].append('pandas')
-        if 'import numpy' in file_content.lower() or 'from numpy import' in file_content.lower():
-            tech_info['frameworks'].append('numpy')
-        if 'import tensorflow' in file_content.lower() or 'from tensorflow import' in file_content.lower():
-            tech_info['frameworks'].append('tensorflow')
-        if 'import torch' in file_content.lower() or 'from torch import' in file_content.lower():
-            tech_info['frameworks'].append('pytorch')
-            
-        # Extract imports
-        import_lines = []
-        for line in file_content.split('\n'):
-            line = line.strip()
-            if line.startswith('import ') or line.startswith('from '):
-                import_lines.append(line)
+        # Extract imports in one pass over the file, then look for common
+        # Python frameworks among them
+        import_lines = [match.group(1) for match in _PYTHON_IMPORT_PATTERN.finditer(file_content)]
+        frameworks = set()
+        for line in import_lines:
+            frameworks.update(name.lower() for name in _PYTHON_FRAMEWORK_PATTERN.findall(line))
+        tech_info['frameworks'] = [
+            _PYTHON_FRAMEWORK_NAMES.get(name, name) for name in _PYTHON_FRAMEWORKS if name in frameworks
+        ]
         tech_info['imports'] = import_lines
         
         # Identify common patterns
@@ -283,29 +471,62 @@ def get_file_content_from_repo(repo_dir, file_path):
     """
     full_path = os.path.join(repo_dir, file_path)
     try:
-        with open(full_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        # Read the raw bytes in one call and decode them once, skipping the
+        # incremental decoding of a text-mode file
+        with open(full_path, 'rb') as f:
+            return f.read().decode('utf-8')
     except Exception as e:
-        print(f"Error reading file {file_path}: {e}")
+        logger.warning("Error reading file %s: %s", file_path, e)
         return None
 
-def generate_code_review_prompt(file_info, pr_info):
-    """Generate a prompt for code review based on file and PR information.
+# Files shorter than this many characters are sent whole rather than windowed
+FULL_CONTEXT_MAX_CHARS = 4000
+
+def build_context_window(full_content, changed_sections, context_lines=30):
+    """Extract the parts of a file around its changed sections.
     
     Args:
-        file_info (dict): Information about the file being reviewed
-        pr_info (dict): Information about the pull request
+        full_content (str): The full content of the file
+        changed_sections (list): Changed sections from identify_changed_sections
+        context_lines (int): Lines of context to keep on each side of a section
         
     Returns:
-        str: The prompt for the AI code review
+        str: The windows around the changes, each headed by its line range and
+            separated by the number of lines left out, or the full content if
+            the file is small or there are no changed sections to anchor on
     """
-    # Determine the language based on file extension
-    file_path = file_info.get('path', '')
-    ext = file_path.split('.')[-1].lower() if '.' in file_path else ''
+    if not full_content or not changed_sections or len(full_content) < FULL_CONTEXT_MAX_CHARS:
+        return full_content
     
-    language_specific_guidelines = ""
-    if ext == 'py':
-        language_specific_guidelines = """
+    lines = full_content.splitlines()
+    
+    # Clamp each section's window to the file and merge overlapping windows
+    windows = []
+    for section in sorted(changed_sections, key=lambda section: section['start_line']):
+        start = max(1, section['start_line'] - context_lines)
+        end = min(len(lines), max(section['end_line'], section['start_line']) + context_lines)
+        if start > end:
+            continue
+        if windows and start <= windows[-1][1] + 1:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    
+    # Note how many lines are collapsed before, between and after the windows
+    parts = []
+    previous_end = 0
+    for start, end in windows:
+        if start > previous_end + 1:
+            parts.append(f"... {start - previous_end - 1} unchanged lines ...")
+        parts.append(f"--- lines {start}-{end} ---\n" + "\n".join(lines[start - 1:end]))
+        previous_end = end
+    if previous_end < len(lines):
+        parts.append(f"... {len(lines) - previous_end} unchanged lines ...")
+    
+    return "\n".join(parts)
+
+# Language-specific review guidelines, keyed by file extension
+_PYTHON_GUIDELINES = """
 ### Python-Specific Best Practices
 - Does the code follow PEP 8 style guidelines?
 - Are list comprehensions used instead of loops where appropriate?
@@ -322,8 +543,7 @@ def generate_code_review_prompt(file_info, pr_info):
 - Are collections module data structures used appropriately?
 - Is logging used instead of print()?
 """
-    elif ext in ['js', 'jsx', 'ts', 'tsx']:
-        language_specific_guidelines = """
+_JAVASCRIPT_GUIDELINES = """
 ### JavaScript/TypeScript-Specific Best Practices
 - Is ES6+ syntax used appropriately?
 - Are promises and async/await used correctly?
@@ -337,40 +557,39 @@ def generate_code_review_prompt(file_info, pr_info):
 - Are optional chaining and nullish coalescing used for safer code?
 - Is proper module import/export syntax used?
 """
-    
-    # Extract changed lines for more targeted review
-    changed_lines = []
-    for section in file_info.get('changed_sections', []):
-        if 'changed_lines' in section:
-            for line_info in section['changed_lines']:
-                changed_lines.append(f"Line {line_info['line_number']}: {line_info['content']}")
-    
-    changed_lines_text = "\n".join(changed_lines) if changed_lines else "No specific changed lines identified."
-    
-    prompt = f"""
+_LANGUAGE_GUIDELINES = {
+    'py': _PYTHON_GUIDELINES,
+    'js': _JAVASCRIPT_GUIDELINES,
+    'jsx': _JAVASCRIPT_GUIDELINES,
+    'ts': _JAVASCRIPT_GUIDELINES,
+    'tsx': _JAVASCRIPT_GUIDELINES
+}
+
+# The review prompt; only the placeholders change between files
+_PROMPT_TEMPLATE = """
 # Code Review Request
 
 ## Pull Request Information
-- **Title**: {pr_info.get('title', 'N/A')}
-- **Description**: {pr_info.get('description', 'N/A')}
-- **Author**: {pr_info.get('author', 'N/A')}
-- **File**: {file_info.get('path', 'N/A')}
+- **Title**: {title}
+- **Description**: {description}
+- **Author**: {author}
+- **File**: {path}
 
 ## Review Task
 You are a senior software engineer conducting a code review. I need you to provide a DETAILED and SPECIFIC code review with exact line numbers for each issue you identify. Focus on providing actionable feedback for each problematic line of code.
 
-### File Context (Full File)
+### File Context (Around the Changes)
 ```
-{file_info.get('full_content', 'No content available')}
+{context}
 ```
 
 ### Changes Made (Diff)
 ```diff
-{file_info.get('diff', 'No diff available')}
+{diff}
 ```
 
 ### Specific Changed Lines
-{changed_lines_text}
+{changed_lines}
 
 ## Review Guidelines
 Please focus on the following aspects in your review:
@@ -396,7 +615,7 @@ Please focus on the following aspects in your review:
 - Are proper file permissions set?
 - Is eval() or exec() avoided with user input?
 
-{language_specific_guidelines}
+{language_guidelines}
 
 ### Critical Issues to Flag
 - Mutating objects while iterating
@@ -423,7 +642,45 @@ Your review must be extremely specific with exact line numbers for each issue. D
 
 Focus on being constructive and educational in your feedback. Prioritize the most important issues rather than listing every minor detail.
 """
-    return prompt
+
+# The prompt template with each language's guidelines filled in once at import.
+# The guidelines contain no braces, so the result is still a format template
+_PROMPT_TEMPLATES = {
+    ext: _PROMPT_TEMPLATE.replace("{language_guidelines}", guidelines)
+    for ext, guidelines in _LANGUAGE_GUIDELINES.items()
+}
+_DEFAULT_PROMPT_TEMPLATE = _PROMPT_TEMPLATE.replace("{language_guidelines}", "")
+
+def generate_code_review_prompt(file_info, pr_info):
+    """Generate a prompt for code review based on file and PR information.
+    
+    Args:
+        file_info (dict): Information about the file being reviewed
+        pr_info (dict): Information about the pull request
+        
+    Returns:
+        str: The prompt for the AI code review
+    """
+    # Determine the language based on file extension
+    file_path = file_info.get('path', '')
+    ext = file_path.split('.')[-1].lower() if '.' in file_path else ''
+    
+    # Extract changed lines for more targeted review
+    changed_lines_text = "\n".join(
+        f"Line {line_number}: {content}"
+        for section in file_info.get('changed_sections', [])
+        for line_number, content in zip(section['changed_line_numbers'], section['content'])
+    ) or "No specific changed lines identified."
+    
+    return _PROMPT_TEMPLATES.get(ext, _DEFAULT_PROMPT_TEMPLATE).format_map({
+        'title': pr_info.get('title', 'N/A'),
+        'description': pr_info.get('description', 'N/A'),
+        'author': pr_info.get('author', 'N/A'),
+        'path': file_info.get('path', 'N/A'),
+        'context': file_info.get('context') or 'No content available',
+        'diff': file_info.get('diff', 'No diff available'),
+        'changed_lines': changed_lines_text
+    })
 
 def get_ai_code_review(file_info, pr_info):
     """Get an AI-generated code review for a file in a pull request.
@@ -436,27 +693,70 @@ def get_ai_code_review(file_info, pr_info):
         str: The AI-generated code review
     """
     try:
+        # Reuse the review of an identical change to the same file
+        cache_key = review_cache_key(
+            ANTHROPIC_MODEL,
+            PROMPT_VERSION,
+            file_info.get('path'),
+            file_info.get('diff'),
+            review_cache_key(file_info.get('full_content'))
+        )
+        cached_review = REVIEW_CACHE.get(cache_key)
+        if cached_review is not None:
+            return cached_review
+        
         client = initialize_anthropic_client()
         prompt = generate_code_review_prompt(file_info, pr_info)
         
         try:
-            response = client.messages.create(
-                model=ANTHROPIC_MODEL,
-                max_tokens=1024,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            # Stream the response so text is consumed as it is generated and a
+            # slow review can be cut off. The semaphore caps concurrent calls
+            # for the whole process, not just for this PR
+            with _ANTHROPIC_SEMAPHORE:
+                deadline = time.monotonic() + ANTHROPIC_REVIEW_TIMEOUT
+                with client.messages.stream(
+                    model=ANTHROPIC_MODEL,
+                    max_tokens=1024,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    timeout=ANTHROPIC_REVIEW_TIMEOUT
+                ) as stream:
+                    text_parts = []
+                    for text in stream.text_stream:
+                        text_parts.append(text)
+                        if time.monotonic() > deadline:
+                            raise TimeoutError(f"review took longer than {ANTHROPIC_REVIEW_TIMEOUT:g}s")
+            review = "".join(text_parts)
             
-            return response.content[0].text
+            REVIEW_CACHE.put(cache_key, review)
+            return review
         except Exception as api_error:
-            print(f"Error calling Anthropic API: {api_error}")
+            logger.warning("Error calling Anthropic API: %s", api_error)
             # Fallback to a basic review
             return generate_fallback_review(file_info)
     except Exception as e:
-        print(f"Error generating AI code review: {e}")
+        logger.exception("Error generating AI code review: %s", e)
         return generate_fallback_review(file_info)
 
+# Static parts of the fallback review
+_FALLBACK_SECTION_CHECKLIST = (
+    "Changes were made in this section. Please review for:\n"
+    "- Code correctness\n"
+    "- Potential bugs\n"
+    "- Code style and best practices\n"
+    "- Performance considerations\n"
+)
+_FALLBACK_RECOMMENDATIONS = """
+## Recommendations
+1. Review the changes manually for any potential issues
+2. Ensure proper error handling is in place
+3. Check for consistent coding style
+4. Verify that the changes meet the requirements
+
+Note: This is a fallback review generated because the AI-powered review system encountered an error.
+"""
+
 def generate_fallback_review(file_info):
     """Generate a basic fallback review when the AI review fails.
     
@@ -470,7 +770,7 @@ def generate_fallback_review(file_info):
     changed_sections = file_info.get('changed_sections', [])
     num_sections = len(changed_sections)
     
-    review = f"""
+    parts = [f"""
 # Code Review for {file_path}
 
 ## Summary
@@ -479,40 +779,30 @@ This is an automated review of the changes in this file. The AI-powered review c
 ## Changes Overview
 - File: {file_path}
 - Number of changed sections: {num_sections}
-"""
+"""]
     
     if num_sections > 0:
-        review += "\n## Changed Sections\n"
+        parts.append("\n## Changed Sections\n")
         for i, section in enumerate(changed_sections):
             start_line = section.get('start_line', 'Unknown')
             end_line = section.get('end_line', 'Unknown')
-            review += f"\n### Section {i+1} (Lines {start_line}-{end_line})\n"
-            review += "Changes were made in this section. Please review for:\n"
-            review += "- Code correctness\n"
-            review += "- Potential bugs\n"
-            review += "- Code style and best practices\n"
-            review += "- Performance considerations\n"
-    
-    review += """
-## Recommendations
-1. Review the changes manually for any potential issues
-2. Ensure proper error handling is in place
-3. Check for consistent coding style
-4. Verify that the changes meet the requirements
-
-Note: This is a fallback review generated because the AI-powered review system encountered an error.
-"""
+            parts.append(f"\n### Section {i+1} (Lines {start_line}-{end_line})\n")
+            parts.append(_FALLBACK_SECTION_CHECKLIST)
     
-    return review
+    parts.append(_FALLBACK_RECOMMENDATIONS)
+    
+    return "".join(parts)
 
-def analyze_pr_file(repo_dir, file_info, base_branch, head_branch):
+def analyze_pr_file(repo_dir, file_info, base_branch, head_branch, diffs=None):
     """Analyze a file in a pull request and prepare it for review.
     
     Args:
         repo_dir (str): Path to the repository
-        file_info (dict): Information about the file from GitHub API
+        file_info (dict): Information about the file from GitHub API, including
+            its 'patch' when GitHub provides one
         base_branch (str): Base branch for comparison
         head_branch (str): Head branch for comparison
+        diffs (dict): Pre-computed diffs keyed by file path, from get_full_pr_diff
         
     Returns:
         dict: Enhanced file information with content and diff
@@ -522,8 +812,14 @@ def analyze_pr_file(repo_dir, file_info, base_branch, head_branch):
     # Get the full content of the file
     full_content = get_file_content_from_repo(repo_dir, file_path)
     
-    # Get the diff for the file
-    diff = get_file_diff(repo_dir, file_path, base_branch, head_branch)
+    # Use the patch GitHub already sent with the PR file list; it is missing
+    # for binary files and very large diffs, so fall back to git diff then
+    diff = file_info.get('patch')
+    if diff is None:
+        if diffs is not None:
+            diff = diffs.get(file_path)
+        else:
+            diff = get_file_diff(repo_dir, file_path, base_branch, head_branch)
     
     # Identify changed sections
     changed_sections = identify_changed_sections(diff)
@@ -531,6 +827,7 @@ def analyze_pr_file(repo_dir, file_info, base_branch, head_branch):
     return {
         'path': file_path,
         'full_content': full_content,
+        'context': build_context_window(full_content, changed_sections),
         'diff': diff,
         'changed_sections': changed_sections,
         'status': file_info.get('status'),
@@ -539,7 +836,47 @@ def analyze_pr_file(repo_dir, file_info, base_branch, head_branch):
         'changes': file_info.get('changes')
     }
 
-def review_pr_files(repo_full_name, pr_number, pr_files, base_branch, head_branch, pr_info):
+def should_skip_review(file_info):
+    """Check whether a PR file is not worth sending for an AI review.
+    
+    Args:
+        file_info (dict): Information about the file from the PR file list
+        
+    Returns:
+        bool: True for removed, non-code, generated, vendored, minified or very
+            large files
+    """
+    file_path = file_info.get('filename', '')
+    directories, _, file_name = file_path.rpartition('/')
+    
+    return (
+        file_info.get('status') == 'removed'
+        or os.path.splitext(file_name)[1].lower() in SKIP_REVIEW_EXTENSIONS
+        or file_name in SKIP_REVIEW_FILENAMES
+        or file_name.endswith(SKIP_REVIEW_SUFFIXES)
+        or '.min.' in file_name
+        or not SKIP_REVIEW_DIRECTORIES.isdisjoint(directories.split('/'))
+        or (file_info.get('changes') or 0) > MAX_REVIEW_CHANGES
+        or (file_info.get('additions') or 0) > MAX_REVIEW_ADDITIONS
+    )
+
+def is_binary_file(repo_dir, file_path):
+    """Check whether a file in the local repository looks binary.
+    
+    Args:
+        repo_dir (str): Path to the repository
+        file_path (str): Path to the file
+        
+    Returns:
+        bool: True if the first 8 KiB of the file contain a NUL byte
+    """
+    try:
+        with open(os.path.join(repo_dir, file_path), 'rb') as f:
+            return b'\0' in f.read(8192)
+    except OSError:
+        return False
+
+def review_pr_files(repo_full_name, pr_number, pr_files, base_branch, head_branch, pr_info, head_sha=None):
     """Review files in a pull request using AI.
     
     Args:
@@ -547,32 +884,71 @@ def review_pr_files(repo_full_name, pr_number, pr_files, base_branch, head_branc
         pr_number (int): The pull request number
         pr_files (list): List of files in the pull request
         base_branch (str): Base branch for comparison
-        head_branch (str): Head branch for comparison
+        head_branch (str): Head branch of the PR (the PR's head is fetched
+            through its pull request ref, which also covers forks)
         pr_info (dict): Information about the pull request
+        head_sha (str): The PR's head commit to review
         
     Returns:
         list: List of reviews for each file
     """
-    # Clone the repository
-    repo_dir = clone_repository(repo_full_name, head_branch)
-    
-    reviews = []
-    
-    for file_info in pr_files:
-        # Skip deleted files
-        if file_info.get('status') == 'removed':
-            continue
-        
-        # Analyze the file
-        enhanced_file_info = analyze_pr_file(repo_dir, file_info, base_branch, head_branch)
+    def review_file(enhanced_file_info):
+        # Pure renames and deletion-only changes have nothing new to review
+        if not any(section['content'] for section in enhanced_file_info['changed_sections']):
+            return None
         
         # Generate AI review
         review = get_ai_code_review(enhanced_file_info, pr_info)
         
-        reviews.append({
+        return {
             'file': enhanced_file_info,
             'review': review
-        })
+        }
+    
+    # Skip deleted files and files that are not code
+    files_to_review = [file_info for file_info in pr_files if not should_skip_review(file_info)]
+    
+    if not files_to_review:
+        return []
+    
+    # The working copy is shared with other webhook workers, so keep it locked
+    # until every file has been read; the AI reviews run after it is released
+    with repository_lock(repo_full_name):
+        # Fetch the PR, checking out only the files under review
+        repo_dir = clone_repository(
+            repo_full_name,
+            pr_number,
+            base_branch,
+            head_sha=head_sha,
+            paths=[file_info['filename'] for file_info in files_to_review]
+        )
+        base_ref = f"origin/{base_branch}"
+        
+        # GitHub sends no patch for binary files, so check those before reviewing
+        files_to_review = [
+            file_info for file_info in files_to_review
+            if file_info.get('patch') is not None or not is_binary_file(repo_dir, file_info['filename'])
+        ]
+        
+        # Diff any files GitHub sent no patch for with one git call instead of one
+        # per file, limited to those files
+        diffs = None
+        unpatched_paths = [file_info['filename'] for file_info in files_to_review if file_info.get('patch') is None]
+        if unpatched_paths:
+            diffs = get_full_pr_diff(repo_dir, base_ref, "HEAD", unpatched_paths)
+        
+        files_to_review = [analyze_pr_file(repo_dir, file_info, base_ref, "HEAD", diffs) for file_info in files_to_review]
+    
+    # Review the files concurrently; the work is dominated by waiting on the
+    # AI API. The largest changes take longest, so they are started first,
+    # and the reviews are still returned in the original file order
+    with ThreadPoolExecutor(max_workers=ANTHROPIC_MAX_CONCURRENCY) as executor:
+        futures = {}
+        for index in sorted(range(len(files_to_review)), key=lambda index: -(files_to_review[index].get('changes') or 0)):
+            futures[index] = executor.submit(review_file, files_to_review[index])
+        reviews = [futures[index].result() for index in range(len(files_to_review))]
+    
+    reviews = [review for review in reviews if review is not None]
     
     return reviews
 
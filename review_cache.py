@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Review Cache - A persistent cache of AI code reviews.
+
+Dependency bumps and lint fixes often produce identical changes across pull requests.
+Reviews are stored in a small SQLite database keyed on a hash of what was reviewed, so
+an identical change is only sent to the AI once. SQLite handles locking between the
+processes of a multi-worker deployment.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def review_cache_key(*parts):
+    """Build a cache key from the strings that determine a review.
+
+    Args:
+        *parts (str): The inputs to the review; None is treated as empty
+
+    Returns:
+        str: A 32-character hex BLAKE2b digest of the parts
+    """
+    # BLAKE2b is faster than SHA-256 in software, and the parts are hashed one
+    # at a time so a large file is not copied into one joined string first
+    digest = hashlib.blake2b(digest_size=16)
+    for index, part in enumerate(parts):
+        if index:
+            digest.update(b"\0")
+        digest.update((part or "").encode("utf-8"))
+    return digest.hexdigest()
+
+class ReviewCache:
+    """A thread-safe, size-bounded SQLite store of reviews, evicting the least recently used."""
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        """Open the database on first use, and again in a forked child process."""
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # Let readers in other workers proceed while one writes, and skip
+            # the fsync on every commit; a lost review is only a cache miss
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reviews (key TEXT PRIMARY KEY, review TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS reviews_used_at ON reviews (used_at)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """Look up a cached review.
+
+        Args:
+            key (str): The cache key from review_cache_key
+
+        Returns:
+            str: The cached review, or None if it is not cached or the cache is unavailable
+        """
+        try:
+            with self.lock:
+                connection = self._connect()
+                with connection:
+                    row = connection.execute("SELECT review FROM reviews WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        connection.execute("UPDATE reviews SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0] if row is not None else None
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Review cache lookup failed: %s", e)
+            return None
+
+    def put(self, key, review):
+        """Store a review, evicting the least recently used ones beyond max_entries.
+
+        Args:
+            key (str): The cache key from review_cache_key
+            review (str): The review text
+        """
+        try:
+            with self.lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO reviews (key, review, used_at) VALUES (?, ?, ?)",
+                        (key, review, time.time())
+                    )
+                    connection.execute(
+                        "DELETE FROM reviews WHERE key IN "
+                        "(SELECT key FROM reviews ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Review cache update failed: %s", e)
@@ -6,9 +6,12 @@ This provides a one-stop testing solution for the GitHub bot.
 
 import os
 import sys
-import subprocess
+import socket
+import threading
 import time
 import platform
+import importlib
+import functools
 
 def print_header(title):
     """Print a formatted header."""
@@ -16,19 +19,6 @@ def print_header(title):
     print(f" {title} ".center(60, "="))
     print("=" * 60 + "\n")
 
-def run_command(command, shell=False):
-    """Run a command and return its exit code."""
-    try:
-        if isinstance(command, list) and shell:
-            # Convert list to string if shell=True
-            command = " ".join(command)
-        
-        process = subprocess.run(command, shell=shell, check=False)
-        return process.returncode
-    except Exception as e:
-        print(f"Error running command: {e}")
-        return 1
-
 def check_environment():
     """Check if the virtual environment is activated."""
     if not os.environ.get("VIRTUAL_ENV"):
@@ -47,8 +37,11 @@ def check_environment():
 def check_files():
     """Check if all required files exist."""
     required_files = [
+        "bot_common.py",
+        "env_loader.py",
         "issue_bot.py",
         "pr_bot.py",
+        "app.py",
         ".env",
         "requirements.txt",
         "test_github_auth.py",
@@ -57,7 +50,10 @@ def check_files():
         "test_pr_bot.py"
     ]
     
-    missing_files = [f for f in required_files if not os.path.exists(f)]
+    # List the directory once instead of checking each file separately
+    with os.scandir('.') as entries:
+        existing_files = {entry.name for entry in entries}
+    missing_files = [f for f in required_files if f not in existing_files]
     
     if missing_files:
         print("ERROR: The following required files are missing:")
@@ -69,8 +65,9 @@ def check_files():
 
 def check_test_env_vars():
     """Check if the test environment variables are set."""
-    from dotenv import load_dotenv
-    load_dotenv()
+    # The test modules imported later share this load of .env
+    from env_loader import load_env_once
+    load_env_once()
     
     repo = os.getenv("GITHUB_REPO", "your-username/your-repo")
     username = os.getenv("GITHUB_USERNAME", "your-username")
@@ -142,189 +139,167 @@ def test_ngrok():
         print(f"Error running ngrok test: {e}")
         return 1
 
-def test_flask_app():
-    """Test if the Issue Bot can start."""
-    print_header("Testing Issue Bot")
+def wait_for_port(port, timeout=5.0):
+    """Wait until something accepts connections on a local port.
     
-    print("Starting Issue Bot in test mode...")
+    Args:
+        port (int): The port to check
+        timeout (float): Seconds to keep trying
+        
+    Returns:
+        bool: True if the port accepted a connection in time
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(('localhost', port)) == 0:
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.025)
+
+# The bots under test, in the order they are tested. "details" are settings
+# read from the test module for the banner, and "events" are the webhook
+# simulations to send as (description, test module function, arguments).
+BOTS = [
+    {
+        "name": "Issue Bot",
+        "module": "issue_bot",
+        "port": 5000,
+        "test_module": "test_bot",
+        "details": [("Issue Number", "ISSUE_NUMBER"), ("Commenter", "COMMENTER_LOGIN")],
+        "events": [
+            ("Testing ping event", "test_ping_event", ()),
+            ("Testing /greet command", "simulate_issue_comment_event", ("/greet",)),
+            ("Testing non-command comment", "simulate_issue_comment_event", ("This is a regular comment, not a command.",))
+        ]
+    },
+    {
+        "name": "PR Bot",
+        "module": "pr_bot",
+        "port": 5001,
+        "test_module": "test_pr_bot",
+        "details": [("PR Number", "PR_NUMBER"), ("PR Creator", "PR_CREATOR")],
+        "events": [
+            ("Testing ping event", "test_ping_event", ()),
+            ("Testing PR opened event", "simulate_pr_opened_event", ())
+        ]
+    }
+]
+
+# Servers of the bots kept running for the webhook tests, stopped by stop_bots()
+_RUNNING_SERVERS = []
+
+def stop_bots():
+    """Stop the bots that test_bot_starts kept running."""
+    while _RUNNING_SERVERS:
+        server = _RUNNING_SERVERS.pop()
+        server.shutdown()
+        server.server_close()
+
+def _run_in_daemon_thread(job_id, func, *args):
+    """Stand-in for bot_common.run_in_background while a bot runs in the test suite.
     
-    # Use a different approach based on the operating system
-    if platform.system() == "Windows":
-        flask_process = subprocess.Popen(
-            [sys.executable, "issue_bot.py"],
-            creationflags=subprocess.CREATE_NEW_CONSOLE
-        )
-    else:
-        # For macOS/Linux, start in background
-        flask_process = subprocess.Popen(
-            [sys.executable, "issue_bot.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+    The greeting or review still runs, but on a daemon thread, so a job that is
+    still retrying GitHub when the suite ends does not keep the process alive.
+    """
+    threading.Thread(target=func, args=args, daemon=True).start()
+    return True
+
+def test_bot_starts(bot):
+    """Test if a bot can start, serving its Flask app from a background thread of this process.
     
-    # Give the Flask app time to start
-    print("Waiting for Issue Bot to start...")
-    time.sleep(3)
+    Importing the bot in-process avoids starting a second Python interpreter,
+    and the server is listening as soon as it has been created, so there is
+    nothing to wait for.
     
-    # Check if the process is still running
-    if flask_process.poll() is None:
-        print("Issue Bot started successfully!")
-        
-        # Ask if user wants to keep it running
-        keep_running = input("Keep Issue Bot running for webhook tests? (y/n): ").strip().lower()
+    Args:
+        bot (dict): The bot's entry in BOTS
         
-        if keep_running != 'y':
-            print("Stopping Issue Bot...")
-            flask_process.terminate()
-            return 0
-        else:
-            print("Issue Bot will continue running in the background.")
-            print("Remember to stop it manually when you're done testing.")
-            return 0
-    else:
-        print("ERROR: Issue Bot failed to start.")
-        return 1
-
-def test_webhook():
-    """Run the webhook simulation test."""
-    print_header("Testing Webhook Simulation")
-    
-    # Check if Issue Bot is running on port 5000
-    import socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result = sock.connect_ex(('localhost', 5000))
-    sock.close()
+    Returns:
+        int: 0 if the bot started, 1 otherwise
+    """
+    name = bot["name"]
+    print_header(f"Testing {name}")
     
-    if result != 0:
-        print("ERROR: Issue Bot is not running on port 5000.")
-        print("Please start the Issue Bot first with:")
-        print("  python issue_bot.py")
-        return 1
+    print(f"Starting {name} in test mode...")
     
     try:
-        # Import the test_bot module and run its functions directly
-        import test_bot
-        
-        print("GitHub Bot Test Script")
-        print("=====================")
-        print(f"Bot URL: {test_bot.BOT_URL}")
-        print(f"Repository: {test_bot.REPO_FULL_NAME}")
-        print(f"Issue Number: {test_bot.ISSUE_NUMBER}")
-        print(f"Commenter: {test_bot.COMMENTER_LOGIN}")
-        print("=====================")
-        
-        # First, test if the server is running
-        try:
-            root_response = test_bot.requests.get("http://localhost:5000/")
-            print(f"Server status: {root_response.status_code} - {root_response.text.strip()}")
-        except test_bot.requests.exceptions.ConnectionError:
-            print("ERROR: Could not connect to the bot server. Make sure it's running on http://localhost:5000")
-            return 1
-        
-        print("\n1. Testing ping event...")
-        test_bot.test_ping_event()
-        
-        print("\n2. Testing /greet command...")
-        test_bot.simulate_issue_comment_event("/greet")
-        
-        print("\n3. Testing non-command comment...")
-        test_bot.simulate_issue_comment_event("This is a regular comment, not a command.")
-        
-        print("\nTests completed. Check the bot's console output for more details.")
-        return 0
+        from werkzeug.serving import make_server
+        bot_module = importlib.import_module(bot["module"])
+        bot_module.run_in_background = _run_in_daemon_thread
+        server = make_server('0.0.0.0', bot["port"], bot_module.app, threaded=True)
+    except SystemExit:
+        # Werkzeug exits instead of raising if the port is already in use
+        print(f"ERROR: {name} failed to start.")
+        return 1
     except Exception as e:
-        print(f"Error running webhook test: {e}")
+        print(f"ERROR: {name} failed to start: {e}")
         return 1
-
-def test_pr_bot():
-    """Test if the PR Bot can start."""
-    print_header("Testing PR Bot")
     
-    print("Starting PR Bot in test mode...")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"{name} started successfully!")
     
-    # Use a different approach based on the operating system
-    if platform.system() == "Windows":
-        flask_process = subprocess.Popen(
-            [sys.executable, "pr_bot.py"],
-            creationflags=subprocess.CREATE_NEW_CONSOLE
-        )
-    else:
-        # For macOS/Linux, start in background
-        flask_process = subprocess.Popen(
-            [sys.executable, "pr_bot.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-    
-    # Give the Flask app time to start
-    print("Waiting for PR Bot to start...")
-    time.sleep(3)
+    # Ask if user wants to keep it running
+    keep_running = input(f"Keep {name} running for webhook tests? (y/n): ").strip().lower()
     
-    # Check if the process is still running
-    if flask_process.poll() is None:
-        print("PR Bot started successfully!")
-        
-        # Ask if user wants to keep it running
-        keep_running = input("Keep PR Bot running for webhook tests? (y/n): ").strip().lower()
-        
-        if keep_running != 'y':
-            print("Stopping PR Bot...")
-            flask_process.terminate()
-            return 0
-        else:
-            print("PR Bot will continue running in the background.")
-            print("Remember to stop it manually when you're done testing.")
-            return 0
+    if keep_running != 'y':
+        print(f"Stopping {name}...")
+        server.shutdown()
+        server.server_close()
     else:
-        print("ERROR: PR Bot failed to start.")
-        return 1
+        _RUNNING_SERVERS.append(server)
+        print(f"{name} will keep running in the background until the test suite finishes.")
+    return 0
 
-def test_pr_webhook():
-    """Run the PR webhook simulation test."""
-    print_header("Testing PR Webhook Simulation")
+def test_bot_webhook(bot):
+    """Run a bot's webhook simulation test.
     
-    # Check if PR Bot is running on port 5001
-    import socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result = sock.connect_ex(('localhost', 5001))
-    sock.close()
+    Args:
+        bot (dict): The bot's entry in BOTS
+        
+    Returns:
+        int: 0 if the simulated events were sent, 1 otherwise
+    """
+    name = bot["name"]
+    port = bot["port"]
+    print_header(f"Testing {name} Webhook Simulation")
     
-    if result != 0:
-        print("ERROR: PR Bot is not running on port 5001.")
-        print("Please start the PR Bot first with:")
-        print("  python pr_bot.py")
+    # Check if the bot is running on its port
+    if not wait_for_port(port):
+        print(f"ERROR: {name} is not running on port {port}.")
+        print(f"Please start the {name} first with:")
+        print(f"  python {bot['module']}.py")
         return 1
     
     try:
-        # Import the test_pr_bot module and run its functions directly
-        import test_pr_bot
+        # Import the bot's test module and run its functions directly
+        test_module = importlib.import_module(bot["test_module"])
         
-        print("GitHub PR Bot Test Script")
+        print(f"GitHub {name} Test Script")
         print("=====================")
-        print(f"Bot URL: {test_pr_bot.BOT_URL}")
-        print(f"Repository: {test_pr_bot.REPO_FULL_NAME}")
-        print(f"PR Number: {test_pr_bot.PR_NUMBER}")
-        print(f"PR Creator: {test_pr_bot.PR_CREATOR}")
+        print(f"Bot URL: {test_module.BOT_URL}")
+        print(f"Repository: {test_module.REPO_FULL_NAME}")
+        for label, attribute in bot["details"]:
+            print(f"{label}: {getattr(test_module, attribute)}")
         print("=====================")
         
         # First, test if the server is running
         try:
-            root_response = test_pr_bot.requests.get("http://localhost:5001/")
+            root_response = test_module.SESSION.get(f"http://localhost:{port}/")
             print(f"Server status: {root_response.status_code} - {root_response.text.strip()}")
-        except test_pr_bot.requests.exceptions.ConnectionError:
-            print("ERROR: Could not connect to the PR bot server. Make sure it's running on http://localhost:5001")
+        except test_module.requests.exceptions.ConnectionError:
+            print(f"ERROR: Could not connect to the {name} server. Make sure it's running on http://localhost:{port}")
             return 1
         
-        print("\n1. Testing ping event...")
-        test_pr_bot.test_ping_event()
-        
-        print("\n2. Testing PR opened event...")
-        test_pr_bot.simulate_pr_opened_event()
+        for number, (description, function_name, args) in enumerate(bot["events"], start=1):
+            print(f"\n{number}. {description}...")
+            getattr(test_module, function_name)(*args)
         
         print("\nTests completed. Check the bot's console output for more details.")
         return 0
     except Exception as e:
-        print(f"Error running PR webhook test: {e}")
+        print(f"Error running {name} webhook test: {e}")
         return 1
 
 def main():
@@ -338,23 +313,25 @@ def main():
     # Run tests in sequence, stopping if any fail
     tests = [
         ("GitHub Authentication", test_github_auth),
-        ("ngrok Connectivity", test_ngrok),
-        ("Issue Bot", test_flask_app),
-        ("Issue Bot Webhook", test_webhook),
-        ("PR Bot", test_pr_bot),
-        ("PR Bot Webhook", test_pr_webhook)
+        ("ngrok Connectivity", test_ngrok)
     ]
+    for bot in BOTS:
+        tests.append((bot["name"], functools.partial(test_bot_starts, bot)))
+        tests.append((f"{bot['name']} Webhook", functools.partial(test_bot_webhook, bot)))
     
     results = {}
     
-    for name, test_func in tests:
-        print(f"\nRunning {name} test...")
-        result = test_func()
-        results[name] = "PASSED" if result == 0 else "FAILED"
-        
-        if result != 0:
-            print(f"\n{name} test failed. Stopping test suite.")
-            break
+    try:
+        for name, test_func in tests:
+            print(f"\nRunning {name} test...")
+            result = test_func()
+            results[name] = "PASSED" if result == 0 else "FAILED"
+            
+            if result != 0:
+                print(f"\n{name} test failed. Stopping test suite.")
+                break
+    finally:
+        stop_bots()
     
     # Print summary
     print_header("Test Results Summary")
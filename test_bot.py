@@ -4,15 +4,15 @@ Test script for the GitHub bot.
 This script simulates a webhook event from GitHub to test the bot locally.
 """
 
-import json
 import hmac
 import hashlib
 import os
+import orjson
 import requests
-from dotenv import load_dotenv
+from env_loader import load_env_once
 
 # Load environment variables
-load_dotenv()
+load_env_once()
 
 # Configuration
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
@@ -20,6 +20,7 @@ if not WEBHOOK_SECRET:
     raise ValueError("WEBHOOK_SECRET environment variable not set. Check your .env file.")
 
 BOT_URL = "http://localhost:5000/webhook"  # Local bot URL
+SESSION = requests.Session()  # Reuses one connection to the bot for every request
 # Replace these placeholder values with your actual GitHub information
 # The test is failing because these placeholders don't correspond to real GitHub resources
 REPO_FULL_NAME = os.getenv("GITHUB_REPO", "your-username/your-repo")  # Use env var or default to placeholder
@@ -36,13 +37,13 @@ if REPO_FULL_NAME == "your-username/your-repo" or COMMENTER_LOGIN == "your-usern
     print("  GITHUB_USERNAME=your-actual-username")
     print("\nSee TESTING.md for more information on fixing this issue.\n")
 
+# Keyed once; each signature copies it instead of re-deriving the key
+_HMAC_TEMPLATE = hmac.new(WEBHOOK_SECRET.encode('utf-8'), digestmod=hashlib.sha256)
+
 def create_signature(payload_body):
-    """Create a signature for the payload using the webhook secret."""
-    hash_object = hmac.new(
-        WEBHOOK_SECRET.encode('utf-8'),
-        msg=payload_body.encode('utf-8'),
-        digestmod=hashlib.sha256
-    )
+    """Create a signature for the payload (str or bytes) using the webhook secret."""
+    hash_object = _HMAC_TEMPLATE.copy()
+    hash_object.update(payload_body.encode('utf-8') if isinstance(payload_body, str) else payload_body)
     return "sha256=" + hash_object.hexdigest()
 
 def simulate_issue_comment_event(comment_body):
@@ -64,8 +65,8 @@ def simulate_issue_comment_event(comment_body):
         }
     }
     
-    # Convert payload to JSON string
-    payload_body = json.dumps(payload)
+    # Serialize payload to JSON bytes, which are both signed and sent
+    payload_body = orjson.dumps(payload)
     
     # Create signature
     signature = create_signature(payload_body)
@@ -79,7 +80,7 @@ def simulate_issue_comment_event(comment_body):
     
     # Send request to bot
     print(f"Sending simulated webhook event with comment: '{comment_body}'")
-    response = requests.post(BOT_URL, data=payload_body, headers=headers)
+    response = SESSION.post(BOT_URL, data=payload_body, headers=headers)
     
     # Print response
     print(f"Response status code: {response.status_code}")
@@ -90,7 +91,7 @@ def simulate_issue_comment_event(comment_body):
 def test_ping_event():
     """Simulate a GitHub ping event."""
     payload = {"zen": "Keep it simple."}
-    payload_body = json.dumps(payload)
+    payload_body = orjson.dumps(payload)
     signature = create_signature(payload_body)
     
     headers = {
@@ -100,7 +101,7 @@ def test_ping_event():
     }
     
     print("Sending simulated ping event")
-    response = requests.post(BOT_URL, data=payload_body, headers=headers)
+    response = SESSION.post(BOT_URL, data=payload_body, headers=headers)
     
     print(f"Response status code: {response.status_code}")
     print(f"Response body: {response.text}")
@@ -118,7 +119,7 @@ if __name__ == "__main__":
     
     # First, test if the server is running
     try:
-        root_response = requests.get("http://localhost:5000/")
+        root_response = SESSION.get("http://localhost:5000/")
         print(f"Server status: {root_response.status_code} - {root_response.text.strip()}")
     except requests.exceptions.ConnectionError:
         print("ERROR: Could not connect to the bot server. Make sure it's running on http://localhost:5000")
@@ -5,13 +5,14 @@ Utility script to test GitHub API authentication using the Personal Access Token
 
 import os
 import sys
-from github import Github
-from dotenv import load_dotenv
+import time
+import requests
+from env_loader import load_env_once
 
 def test_github_authentication():
     """Test GitHub API authentication and display user information."""
     # Load environment variables
-    load_dotenv()
+    load_env_once()
     
     # Get GitHub PAT from environment
     github_pat = os.getenv("GITHUB_PAT")
@@ -28,35 +29,48 @@ def test_github_authentication():
     
     # Try to authenticate with GitHub
     try:
-        g = Github(github_pat)
-        user = g.get_user()
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"token {github_pat}",
+            "Accept": "application/vnd.github.v3+json"
+        })
+        
+        user_response = session.get("https://api.github.com/user")
+        user_response.raise_for_status()
+        user = user_response.json()
         
         # Get rate limit information
-        rate_limit = g.get_rate_limit()
-        core_rate_limit = rate_limit.core
+        rate_limit_response = session.get("https://api.github.com/rate_limit")
+        rate_limit_response.raise_for_status()
+        core_rate_limit = rate_limit_response.json()["resources"]["core"]
         
         # Display user information
         print("\nGitHub Authentication Successful!")
         print("================================")
-        print(f"Authenticated as: {user.login}")
-        print(f"Name: {user.name or 'Not provided'}")
-        print(f"Email: {user.email or 'Not provided'}")
-        print(f"Organization: {user.company or 'Not provided'}")
-        print(f"Location: {user.location or 'Not provided'}")
-        print(f"Public Repositories: {user.public_repos}")
+        print(f"Authenticated as: {user['login']}")
+        print(f"Name: {user.get('name') or 'Not provided'}")
+        print(f"Email: {user.get('email') or 'Not provided'}")
+        print(f"Organization: {user.get('company') or 'Not provided'}")
+        print(f"Location: {user.get('location') or 'Not provided'}")
+        print(f"Public Repositories: {user.get('public_repos')}")
         
         # Display rate limit information
         print("\nAPI Rate Limit Information:")
-        print(f"Remaining requests: {core_rate_limit.remaining}/{core_rate_limit.limit}")
-        print(f"Reset time: {core_rate_limit.reset.strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"Remaining requests: {core_rate_limit['remaining']}/{core_rate_limit['limit']}")
+        print(f"Reset time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(core_rate_limit['reset']))}")
         
         # Test listing repositories
         print("\nTesting repository access...")
-        repos = list(user.get_repos(sort="updated", direction="desc")[:5])
+        repos_response = session.get(
+            "https://api.github.com/user/repos",
+            params={"sort": "updated", "direction": "desc", "per_page": 5}
+        )
+        repos_response.raise_for_status()
+        repos = repos_response.json()
         if repos:
             print("Recently updated repositories:")
             for repo in repos:
-                print(f"- {repo.full_name} (Updated: {repo.updated_at.strftime('%Y-%m-%d')})")
+                print(f"- {repo['full_name']} (Updated: {repo['updated_at'][:10]})")
         else:
             print("No repositories found or accessible with this token.")
         
@@ -8,19 +8,21 @@ import os
 import json
 import hmac
 import hashlib
+import orjson
 import requests
 import unittest.mock
-from dotenv import load_dotenv
+from env_loader import load_env_once
 import time
 import tempfile
 import shutil
 import subprocess
 
 # Load environment variables
-load_dotenv()
+load_env_once()
 
 # Configuration
 BOT_URL = "http://localhost:5001/webhook"  # PR bot runs on port 5001
+SESSION = requests.Session()  # Reuses one connection to the bot for every request
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
 GITHUB_PAT = os.getenv("GITHUB_PAT", "")
 REPO_FULL_NAME = os.getenv("GITHUB_REPO", "your-username/your-repo")
@@ -28,18 +30,22 @@ PR_NUMBER = os.getenv("GITHUB_PR_NUMBER", "1")
 PR_CREATOR = os.getenv("GITHUB_USERNAME", "your-username")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 
+# Keyed once; each signature copies it instead of re-deriving the key
+_HMAC_TEMPLATE = hmac.new(WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+
 def sign_payload(payload):
-    """Create a GitHub-compatible HMAC signature for the webhook payload."""
+    """Create a GitHub-compatible HMAC signature for the webhook payload (bytes)."""
     if not WEBHOOK_SECRET:
         print("WARNING: WEBHOOK_SECRET not set in .env file")
         return ""
     
-    mac = hmac.new(WEBHOOK_SECRET.encode(), payload.encode(), hashlib.sha256)
+    mac = _HMAC_TEMPLATE.copy()
+    mac.update(payload)
     return f"sha256={mac.hexdigest()}"
 
 def send_webhook_event(event_type, payload):
     """Send a simulated webhook event to the bot."""
-    payload_json = json.dumps(payload)
+    payload_json = orjson.dumps(payload)
     signature = sign_payload(payload_json)
     
     headers = {
@@ -49,7 +55,7 @@ def send_webhook_event(event_type, payload):
         "User-Agent": "GitHub-Hookshot/Test"
     }
     
-    response = requests.post(BOT_URL, data=payload_json, headers=headers)
+    response = SESSION.post(BOT_URL, data=payload_json, headers=headers)
     
     print(f"Response status code: {response.status_code}")
     try:
@@ -315,7 +321,7 @@ def test_ai_code_review():
         'path': 'test_file.py',
         'full_content': get_mock_file_content(),
         'diff': '@@ -0,0 +1,9 @@\n+#!/usr/bin/env python3\n+# This is a test file for the PR bot\n+\n+def hello_world():\n+    # A simple function that prints hello world\n+    print("Hello, World!")\n+\n+if __name__ == "__main__":\n+    hello_world()',
-        'changed_sections': [{'start_line': 1, 'end_line': 9, 'content': ['#!/usr/bin/env python3', '# This is a test file for the PR bot', '', 'def hello_world():', '    # A simple function that prints hello world', '    print("Hello, World!")', '', 'if __name__ == "__main__":', '    hello_world()']}]
+        'changed_sections': [{'start_line': 1, 'end_line': 9, 'content': ['#!/usr/bin/env python3', '# This is a test file for the PR bot', '', 'def hello_world():', '    # A simple function that prints hello world', '    print("Hello, World!")', '', 'if __name__ == "__main__":', '    hello_world()'], 'header': '@@ -0,0 +1,9 @@', 'changed_line_numbers': [1, 2, 3, 4, 5, 6, 7, 8, 9]}]
     }
     
     # Create test PR info
@@ -359,7 +365,7 @@ if __name__ == "__main__":
     
     # First, test if the server is running
     try:
-        root_response = requests.get("http://localhost:5001/")
+        root_response = SESSION.get("http://localhost:5001/")
         print(f"Server status: {root_response.status_code} - {root_response.text.strip()}")
     except requests.exceptions.ConnectionError:
         print("ERROR: Could not connect to the PR bot server. Make sure it's running on http://localhost:5001")